@@ -0,0 +1,139 @@
+"""
+asyncio API for PLUQin (Python 3 only). Queries run in an executor so
+HDF5 reads, region lookups and scoring do not block the event loop.
+The default thread pool shares pluq.cache.query_cache with the
+synchronous API, so PDFs and indexes loaded by one are used by the
+other.
+
+Concurrent identical requests are coalesced into one call of
+pluqin.main. A caller that times out or is cancelled stops waiting
+without affecting the other callers of the same request, the call
+itself is only cancelled when nobody is waiting for it any more and
+it has not started yet.
+
+    table = await assign_async([[55.0], [18.0]], 'c', timeout=5)
+"""
+import asyncio
+import functools
+
+from pluq.pluqin import main, _peak_array
+
+
+def request_key(resonance_set, experiment_name='c', **kwargs):
+    """
+    Hashable key of a request, equal for requests main answers the
+    same way.
+
+    :param resonance_set: see pluqin.main
+    :param experiment_name: see pluqin.main
+    :param kwargs: other options for pluqin.main
+    """
+    try:
+        peaks = tuple(map(tuple, _peak_array(resonance_set).tolist()))
+    except ValueError:
+        # Ragged peaks, main raises the error.
+        peaks = repr(resonance_set)
+    options = tuple(sorted((x, repr(y)) for x, y in kwargs.items()))
+    return peaks, experiment_name, options
+
+
+class AsyncAssigner(object):
+    """
+    Runs pluqin.main in an executor and coalesces identical requests
+    that are in flight at the same time.
+
+    :param executor: concurrent.futures.Executor or None for the event
+        loop's default thread pool. A process pool also works but every
+        worker then keeps its own cache.
+    :param timeout: float, default seconds to wait for a result or
+        None to wait forever
+    """
+    def __init__(self, executor=None, timeout=None):
+        self.executor = executor
+        self.timeout = timeout
+        # (loop, key) -> [future, number of waiters]
+        self._pending = dict()
+
+    async def assign(self, resonance_set, experiment_name='c', timeout=None,
+                     **kwargs):
+        """
+        Awaitable pluqin.main.
+
+        :param resonance_set: see pluqin.main
+        :param experiment_name: see pluqin.main
+        :param timeout: float, seconds to wait, default self.timeout
+        :param kwargs: other options for pluqin.main
+        :return: main's return value
+        :raises asyncio.TimeoutError: if the timeout runs out first
+        """
+        loop = asyncio.get_running_loop()
+        key = (loop, request_key(resonance_set, experiment_name, **kwargs))
+
+        try:
+            pending = self._pending[key]
+        except KeyError:
+            call = functools.partial(main, resonance_set, experiment_name,
+                                     **kwargs)
+            future = loop.run_in_executor(self.executor, call)
+            pending = self._pending[key] = [future, 0]
+            future.add_done_callback(lambda x: self._forget(key, x))
+
+        future = pending[0]
+        pending[1] += 1
+        if timeout is None:
+            timeout = self.timeout
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        finally:
+            pending[1] -= 1
+            if pending[1] == 0 and not future.done():
+                # Nobody is waiting, drop the call if it has not started.
+                # It is forgotten first so a new identical request does
+                # not pick up the cancelled future.
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+                future.cancel()
+
+    def _forget(self, key, future):
+        pending = self._pending.get(key)
+        if pending is not None and pending[0] is future:
+            del self._pending[key]
+        # Mark the error as seen, every waiter may have given up.
+        if not future.cancelled():
+            future.exception()
+
+    def in_flight(self):
+        """Number of distinct requests being answered."""
+        return len(self._pending)
+
+
+# Shared by assign_async.
+default_assigner = AsyncAssigner()
+
+
+async def assign_async(resonance_set, experiment_name='c', timeout=None,
+                       **kwargs):
+    """
+    Awaitable pluqin.main using default_assigner, set its executor and
+    timeout to configure it.
+
+    :param resonance_set: see pluqin.main
+    :param experiment_name: see pluqin.main
+    :param timeout: float, seconds to wait or None for the default
+    :param kwargs: other options for pluqin.main
+    """
+    return await default_assigner.assign(resonance_set, experiment_name,
+                                         timeout, **kwargs)
+
+
+async def warm_async(experiments=None, executor=None):
+    """
+    Loads the query data into the shared cache without blocking the
+    event loop, see pluq.server.warm.
+    """
+    from pluq.server import warm
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(warm, experiments))
@@ -105,6 +105,76 @@ class ProteinID(object):
         return "{}: {}".format(self.idtype, self.id)
 
 
+# Correlations of one residue, see _residue_correlations.
+_correlation_catalog = dict()
+
+
+def _residue_correlations(res, exp_key, structure, ignoresymmetry,
+                          offdiagonal):
+    """
+    Correlations of one residue for ProteinSeq.relevant_correlations.
+    They only depend on the arguments so each catalog is built once,
+    the Correlation objects are shared and should not be changed.
+
+    :param res: 1-letter amino acid code str
+    :param exp_key: (nuclei, bonds, symmetric, diagonal) of the
+        CSExperiment
+    :return: tuple(Correlation, ...)
+    """
+    key = (res, exp_key, structure, ignoresymmetry, offdiagonal)
+    try:
+        return _correlation_catalog[key]
+    except KeyError:
+        pass
+
+    nuclei, bonds, symmetric, diagonal = exp_key
+    dims = len(nuclei)
+
+    patoms = []
+    for nucleus in nuclei:
+        patoms.append(
+            [x for x in aminoacids.aa_atoms[res] if x[0] == nucleus])
+
+    if symmetric and diagonal:
+        groups = combi_r({x for x in chain(*patoms)}, dims)
+    elif symmetric:
+        groups = combi({x for x in chain(*patoms)}, dims)
+    else:
+        groups = product(*patoms)
+
+    possible = []
+    if dims == 1:
+        possible.extend(groups)
+
+    else:
+        for group in groups:
+            if (aminoacids.bonds_between_atoms(
+                    res, group[0], group[1]) <= bonds):
+                possible.append(group)
+
+    correlations = []
+    for atoms in possible:
+
+        if len(set(atoms)) < dims and not offdiagonal:
+                continue
+        if structure:
+            if [atom for atom in atoms if atom in aminoacids.ss_atoms]:
+                ss_list = ['H', 'E', 'C', 'X']
+            else:
+                ss_list = ['X']
+        else:
+            ss_list = [None]
+
+        for ss in ss_list:
+            correlations.append(Correlation(res, atoms, ss))
+
+            if symmetric and not ignoresymmetry:
+                correlations.append(Correlation(res, atoms[::-1], ss))
+
+    _correlation_catalog[key] = tuple(correlations)
+    return _correlation_catalog[key]
+
+
 class ProteinSeq(object):
     """
     Protein Sequence Class.
@@ -173,47 +243,12 @@ class ProteinSeq(object):
         """
         assert isinstance(cs_exp, CSExperiment)
 
+        exp_key = (cs_exp.nuclei, cs_exp.bonds, cs_exp.symmetric,
+                   cs_exp.diagonal)
         correlations = []
         for res in self.unique:
-            patoms = []
-            for nucleus in cs_exp.nuclei:
-                patoms.append(
-                    [x for x in aminoacids.aa_atoms[res] if x[0] == nucleus])
-
-            if cs_exp.symmetric and cs_exp.diagonal:
-                groups = combi_r({x for x in chain(*patoms)}, cs_exp.dims)
-            elif cs_exp.symmetric:
-                groups = combi({x for x in chain(*patoms)}, cs_exp.dims)
-            else:
-                groups = product(*patoms)
-
-            possible = []
-            if cs_exp.dims == 1:
-                possible.extend(groups)
-
-            else:
-                for group in groups:
-                    if (aminoacids.bonds_between_atoms(
-                            res, group[0], group[1]) <= cs_exp.bonds):
-                        possible.append(group)
-
-            for atoms in possible:
-
-                if len(set(atoms)) < cs_exp.dims and not offdiagonal:
-                        continue
-                if structure:
-                    if [atom for atom in atoms if atom in aminoacids.ss_atoms]:
-                        ss_list = ['H', 'E', 'C', 'X']
-                    else:
-                        ss_list = ['X']
-                else:
-                    ss_list = [None]
-
-                for ss in ss_list:
-                    correlations.append(Correlation(res, atoms, ss))
-
-                    if cs_exp.symmetric and not ignoresymmetry:
-                        correlations.append(Correlation(res, atoms[::-1], ss))
+            correlations.extend(_residue_correlations(
+                res, exp_key, structure, ignoresymmetry, offdiagonal))
         return correlations
 
     def __repr__(self):
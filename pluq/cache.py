@@ -0,0 +1,232 @@
+"""
+Process-wide caches for the data files read while answering PLUQin
+queries. The PDF files are opened once per experiment and the decoded
+Continuous objects are kept in a bounded least-recently-used cache
+keyed by (experiment, correlation string), the X/H/C/E stacks by
+(experiment, residue, atoms). Region and range indexes are built once
+per (experiment, level), 2D experiments use the precomputed region
+raster when there is one.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import pluq.fileio as fileio
+import pluq.inbase as inbase
+from pluq.index import IntervalIndex, RegionIndex
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize',
+                                     'currsize'])
+
+# Marks correlations without a PDF so repeated lookups do not go back
+# to the file.
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    Bounded, thread-safe least-recently-used cache.
+
+    :param maxsize: int, maximum number of entries or None for no
+        bound
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        """
+        Return the value cached under key. On a miss the value is made
+        by calling factory(), exceptions raised by factory are not
+        cached.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                value = factory()
+            else:
+                self.hits += 1
+
+            self._data[key] = value
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return value
+
+    def info(self):
+        """
+        :rtype: CacheInfo
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._data))
+
+    def clear(self):
+        """Remove every entry and reset the statistics."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class QueryCache(object):
+    """
+    Holds the open PDF files, decoded Continuous objects and the
+    region and range indexes used by pluq.pluqin across calls.
+
+    :param maxsize: int, maximum number of Continuous objects, and of
+        ContinuousStack objects, kept
+    """
+    def __init__(self, maxsize=4096):
+        self._files = dict()
+        self._lock = threading.RLock()
+        self.pdfs = LRUCache(maxsize)
+        self.stacks = LRUCache(maxsize)
+        self.indexes = LRUCache(32)
+
+    def pdf_file(self, experiment_name):
+        """
+        Open h5py file with the PDFs of an experiment, the file is only
+        opened on the first request.
+
+        :param experiment_name: key from fileio.pdffile_exptype
+        """
+        with self._lock:
+            try:
+                return self._files[experiment_name]
+            except KeyError:
+                pdf_file = fileio.read_pdf(experiment_name)
+                self._files[experiment_name] = pdf_file
+                return pdf_file
+
+    def get_pdf(self, corr, experiment_name):
+        """
+        Cached version of inbase.get_pdf.
+
+        :param corr: Correlation or correlation str
+        :param experiment_name: key from fileio.pdffile_exptype
+        :rtype: pluq.inbase.Continuous
+        :raises KeyError: if the file has no PDF for the correlation
+        """
+        key = (experiment_name, str(corr))
+
+        def factory():
+            try:
+                return inbase.get_pdf(key[1], self.pdf_file(experiment_name))
+            except KeyError:
+                return _MISSING
+
+        smooth = self.pdfs.get(key, factory)
+        if smooth is _MISSING:
+            raise KeyError(key[1])
+        return smooth
+
+    def get_pdf_stack(self, corr, experiment_name):
+        """
+        Cached inbase.get_pdf_stack, the X/H/C/E PDFs of a correlation.
+        The layers come from get_pdf and share their densities with
+        it.
+
+        :param corr: Correlation
+        :param experiment_name: key from fileio.pdffile_exptype
+        :rtype: pluq.inbase.ContinuousStack
+        :raises KeyError: if the file has no PDF for the correlation
+        """
+        key = (experiment_name, corr.aa, corr.atoms)
+
+        def factory():
+            try:
+                return inbase.get_pdf_stack(
+                    corr, None, lambda x: self.get_pdf(x, experiment_name))
+            except KeyError:
+                return _MISSING
+
+        stack = self.stacks.get(key, factory)
+        if stack is _MISSING:
+            raise KeyError(str(corr))
+        return stack
+
+    def region_index(self, experiment_name, level=95):
+        """
+        Spatial index over the 2D regions of an experiment.
+
+        :param experiment_name: key from fileio.shapefile_exptype
+        :param level: int, confidence level of the regions
+        :rtype: pluq.index.RegionIndex
+        """
+        key = ('region', experiment_name, level)
+        return self.indexes.get(key, lambda: RegionIndex(
+            fileio.read_region(experiment_name, level)))
+
+    def region_lookup(self, experiment_name, level=95):
+        """
+        Fastest available region membership lookup, the precomputed
+        raster if the experiment has one, otherwise the spatial index.
+
+        :param experiment_name: key from fileio.shapefile_exptype
+        :param level: int, confidence level of the regions
+        :rtype: pluq.index.RegionRaster or pluq.index.RegionIndex
+        """
+        key = ('raster', experiment_name, level)
+
+        def factory():
+            try:
+                return fileio.read_region_raster(
+                    experiment_name, level,
+                    lambda: self.region_index(experiment_name, level))
+            except (IOError, OSError, KeyError, ValueError):
+                return _MISSING
+
+        raster = self.indexes.get(key, factory)
+        if raster is _MISSING:
+            return self.region_index(experiment_name, level)
+        return raster
+
+    def interval_index(self, experiment_name, level=95):
+        """
+        Index over the 1D chemical shift ranges of an experiment.
+
+        :param experiment_name: key from fileio.pdffile_exptype
+        :param level: int, confidence level of the ranges
+        :rtype: pluq.index.IntervalIndex
+        """
+        key = ('interval', experiment_name, level)
+        return self.indexes.get(key, lambda: IntervalIndex(
+            fileio.read_ranges(self.pdf_file(experiment_name), level)))
+
+    def info(self):
+        """
+        Hit and miss statistics of each cache.
+
+        :return: dict[name] = CacheInfo
+        """
+        with self._lock:
+            n_files = len(self._files)
+        return {'files': CacheInfo(None, None, None, n_files),
+                'pdfs': self.pdfs.info(),
+                'stacks': self.stacks.info(),
+                'indexes': self.indexes.info()}
+
+    def clear(self):
+        """Close the open files and empty every cache."""
+        with self._lock:
+            for pdf_file in self._files.values():
+                pdf_file.close()
+            self._files.clear()
+            self.pdfs.clear()
+            self.stacks.clear()
+            self.indexes.clear()
+
+
+# Shared by every query in the process.
+query_cache = QueryCache()
@@ -2,15 +2,26 @@
 Function for reading files related to the PACSY database.
 """
 import os
+import re
 import csv
-from pkg_resources import resource_filename
 from collections import defaultdict
 
 import h5py
-import fiona
+import numpy as np
 from shapely.geometry import shape
 
 from pluq.base import Correlation
+from pluq.index import RegionRaster
+
+
+def _package_file(file_path_name):
+    """
+    Path of a data file shipped in the pluq package. The package is
+    installed unzipped, so this is the path pkg_resources would give
+    without the cost of importing it.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        file_path_name)
 
 
 pdffile_exptype = {'cc': 'cc_pdf_all.h5',
@@ -28,11 +39,93 @@ def read_pdf(exp_type='c'):
     # shape file path
     file_name = pdffile_exptype[exp_type]
     file_path_name = os.path.join('data', 'pdf', file_name)
-    pdf_file = resource_filename(__name__, file_path_name)
+    pdf_file = _package_file(file_path_name)
 
     return h5py.File(pdf_file, 'r')
 
 
+def read_ranges(pdf_file, level=95):
+    """
+    Reads the 1D chemical shift ranges stored next to the PDFs into a
+    dictionary.
+
+    :param pdf_file: open h5py file from read_pdf
+    :param level: int, one of pdf_file.attrs['confidence_levels']
+    :returns dict['Correlation'] = (min, max)
+    :raises ValueError: if the level is not in the file
+    """
+    levels = list(pdf_file.attrs['confidence_levels'])
+    ind = levels.index(level)
+
+    ranges = dict()
+    for key in pdf_file:
+        if not key.endswith(',levs'):
+            continue
+        cs_range = pdf_file[key][ind]
+        ranges[key[:-len(',levs')]] = (min(cs_range), max(cs_range))
+    return ranges
+
+
+region_raster_exptype = {'cc': 'cc_region_raster.npz',
+                         'cn': 'cn_region_raster.npz'}
+
+
+def region_raster_path(exp_name='cc'):
+    """
+    Path of the region raster file of an experiment, the file may not
+    exist.
+
+    :param exp_name: experiment name str in region_raster_exptype
+    """
+    file_path_name = os.path.join('data', 'regions',
+                                  region_raster_exptype[exp_name])
+    return _package_file(file_path_name)
+
+
+def write_region_raster(file_name, rasters):
+    """
+    Saves RegionRasters of one experiment, one per confidence level,
+    to a compressed npz file. The rasters must share names and grid.
+
+    :param file_name: str, path of the new file
+    :param rasters: dict[level int] = pluq.index.RegionRaster
+    """
+    first = rasters[min(rasters)]
+    arrays = {'names': np.array(first.names),
+              'origin': first.origin,
+              'step': np.array(first.step),
+              'levels': np.array(sorted(rasters))}
+    for level, raster in rasters.items():
+        arrays['ids_{}'.format(level)] = raster.ids
+        arrays['boundary_{}'.format(level)] = raster.boundary
+        arrays['palette_{}'.format(level)] = raster.palette
+    np.savez_compressed(file_name, **arrays)
+
+
+def read_region_raster(exp_name='cc', level=95, fallback=None):
+    """
+    Reads a region raster made by inbase.make_region_raster.
+
+    :param exp_name: experiment name str in region_raster_exptype
+    :param level: int, confidence level
+    :param fallback: RegionIndex, or function returning one, for the
+        cells on a region boundary
+    :rtype: pluq.index.RegionRaster
+    :raises IOError: if there is no raster file for the experiment
+    :raises ValueError: if the level is not in the file
+    """
+    with np.load(region_raster_path(exp_name)) as arrays:
+        if level not in arrays['levels']:
+            raise ValueError('No {}% raster for {}'.format(level, exp_name))
+        return RegionRaster(arrays['names'].tolist(),
+                            arrays['origin'],
+                            float(arrays['step']),
+                            arrays['ids_{}'.format(level)],
+                            arrays['boundary_{}'.format(level)],
+                            arrays['palette_{}'.format(level)],
+                            fallback)
+
+
 schema = {'geometry': 'Polygon',
           'properties': {'corr': 'str',
                          'levels': 'float', }}
@@ -54,7 +147,9 @@ def read_region(exp_name='cc', level=95):
     # shape file path
     file_name = shapefile_exptype[exp_name]
     file_path_name = os.path.join('data', 'regions', file_name)
-    shape_file = resource_filename(__name__, file_path_name)
+    shape_file = _package_file(file_path_name)
+
+    import fiona
 
     # Get the Shape files, combine them and add them to a dictionary.
     regions = dict()
@@ -87,7 +182,7 @@ def read_cs_stats(cs_stats_file=None):
 
     if not cs_stats_file:
         file_path_name = os.path.join('data', 'piqc_db', 'CS_STATS_DB.txt')
-        cs_stats_file = resource_filename(__name__, file_path_name)
+        cs_stats_file = _package_file(file_path_name)
 
     cs_stats = defaultdict(_dd)
 
@@ -130,7 +225,7 @@ def read_seq_cs(seq_cs_file=None):
 
     if not read_seq_cs:
         file_path_name = os.path.join('data', 'piqc_db', 'SEQ_CS_DB.txt')
-        seq_cs_file = resource_filename(__name__, file_path_name)
+        seq_cs_file = _package_file(file_path_name)
 
     protein_stats = defaultdict(_dd)
 
@@ -167,6 +262,155 @@ def write_seq_cs(protein_stats, seq_cs_file):
             writer.writerow([seq[0], seq[1]] + stats)
 
 
+peak_list_formats = ('csv', 'sparky', 'nmrpipe')
+
+
+def read_peak_list(fid, fmt='csv', dims=None, axes=None):
+    """
+    Reads peak groups from a peak list. Each group is one PLUQin
+    query: the peaks of one spin system.
+
+    - csv: one peak per line, shifts separated by commas or spaces.
+      Blank lines separate groups. An optional non-numeric first
+      field labels the group. Lines starting with # are comments.
+      Every line must have dims shifts when dims is given.
+    - sparky: Sparky peak list, every peak is a group labeled with
+      its assignment. Shifts come from the w1, w2, ... columns, the
+      columns after them (Data Height, ...) are ignored.
+    - nmrpipe: NMRPipe/nmrDraw peak table (VARS, FORMAT and data
+      lines), every peak is a group labeled with its INDEX. Shifts
+      come from the X_PPM, Y_PPM and Z_PPM columns.
+
+    The shifts must be in the nuclei order of the experiment, for
+    example (C, N) for cn. Sparky lists often have w1 = N and w2 = C,
+    use axes=(1, 0) to swap them.
+
+    :param fid: iterable of lines, for example an open file
+    :param fmt: one of peak_list_formats
+    :param dims: int, number of shifts per peak, sparky and nmrpipe
+        peaks with more shifts are cut to dims
+    :param axes: list of int, positions (from 0) of the shift columns
+        to use, in order, default the first dims columns
+    :return: [(label, [[shift, ...], ...]), ...] in input order
+    :raises ValueError: for an unknown format or a line that can not
+        be read or has too few shifts
+    """
+    if fmt == 'csv':
+        return _read_csv_peaks(fid, dims, axes)
+    elif fmt == 'sparky':
+        return _read_sparky_peaks(fid, dims, axes)
+    elif fmt == 'nmrpipe':
+        return _read_nmrpipe_peaks(fid, dims, axes)
+    else:
+        mesg = '{} is not a known peak list format'.format(fmt)
+        raise ValueError(mesg)
+
+
+def _select_shifts(shifts, dims, axes, line):
+    """
+    The shifts of one peak in the order of axes, cut to dims.
+
+    :raises ValueError: naming the line if there are too few shifts
+    """
+    if axes is not None:
+        if not shifts or max(axes) >= len(shifts):
+            mesg = 'Expected {} shift columns on the line: {}'.format(
+                max(axes) + 1, line.strip())
+            raise ValueError(mesg)
+        shifts = [shifts[k] for k in axes]
+
+    if dims is not None:
+        if len(shifts) < dims:
+            mesg = 'Expected {} shifts on the line: {}'.format(
+                dims, line.strip())
+            raise ValueError(mesg)
+        shifts = shifts[:dims]
+    return shifts
+
+
+def _read_csv_peaks(fid, dims=None, axes=None):
+    groups = []
+    label = None
+    peaks = []
+    for line in fid:
+        line = line.strip()
+        if line.startswith('#'):
+            continue
+
+        if not line:
+            if peaks:
+                groups.append((label, peaks))
+            label = None
+            peaks = []
+            continue
+
+        fields = line.replace(',', ' ').split()
+        try:
+            float(fields[0])
+        except ValueError:
+            if peaks and fields[0] != label:
+                groups.append((label, peaks))
+                peaks = []
+            label = fields[0]
+            fields = fields[1:]
+
+        if axes is not None:
+            fields = _select_shifts(fields, None, axes, line)
+        if not fields or (dims is not None and len(fields) != dims):
+            mesg = 'Expected {} shifts on the line: {}'.format(
+                dims if dims is not None else 'some', line)
+            raise ValueError(mesg)
+        peaks.append([float(x) for x in fields])
+
+    if peaks:
+        groups.append((label, peaks))
+
+    return [(x if x else 'group {}'.format(n + 1), y)
+            for n, (x, y) in enumerate(groups)]
+
+
+def _read_sparky_peaks(fid, dims=None, axes=None):
+    groups = []
+    # Number of w1, w2, ... columns, from the header.
+    n_shifts = None
+    for line in fid:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'Assignment':
+            n_shifts = len([x for x in fields if re.match(r'w\d+$', x)])
+            continue
+
+        shifts = [float(x) for x in fields[1:][:n_shifts]]
+        groups.append((fields[0], [_select_shifts(shifts, dims, axes,
+                                                  line)]))
+    return groups
+
+
+def _read_nmrpipe_peaks(fid, dims=None, axes=None):
+    columns = None
+    groups = []
+    for line in fid:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'VARS':
+            columns = fields[1:]
+            continue
+        if fields[0] in ('FORMAT', 'REMARK', 'DATA', 'NULLVALUE',
+                         'NULLSTRING'):
+            continue
+        if columns is None:
+            raise ValueError('NMRPipe peak table without a VARS line.')
+
+        row = dict(zip(columns, fields))
+        shifts = [float(row[x]) for x in ('X_PPM', 'Y_PPM', 'Z_PPM')
+                  if x in row]
+        groups.append((row.get('INDEX', str(len(groups) + 1)),
+                       [_select_shifts(shifts, dims, axes, line)]))
+    return groups
+
+
 def _dd():
     """
     Magic with the collections module.
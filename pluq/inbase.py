@@ -4,28 +4,23 @@ estimated. Also functions for loading and writing the various data files used
 internally.
 """
 
-# Import everything and the kitchen sink.
+# Only what the query path needs is imported here. scipy, sklearn,
+# skimage and fiona are imported by the functions that use them.
 import os
 import sys
 
 import h5py
 import numpy as np
 
-from skimage import measure
-
-from scipy.interpolate import interp1d, RectBivariateSpline
-
-from sklearn.neighbors import KernelDensity
-from sklearn.model_selection import GridSearchCV
-
-import fiona
 from shapely import speedups
 from shapely.prepared import prep
 from shapely.ops import transform
 from shapely.geometry import MultiPolygon, Polygon, Point, mapping
 
-from pluq.fileio import read_pdf
+from pluq.fileio import (read_pdf, read_region, region_raster_path,
+                         write_region_raster)
 from pluq.base import Correlation, ProteinSeq, CSExperiment
+from pluq.index import RegionRaster, union_bounds
 
 
 # Use shapely speed-ups if they are available.
@@ -40,39 +35,107 @@ class Continuous(object):
     density function.
 
     :param pdf: probability distribution function np.array()
-    :param grid: np.array(x) or np.meshgrid(x, y)
+    :param grid: np.array(x), np.meshgrid(x, y) or the axes (x, y).
+        Only the axes are kept, the meshgrid is made when grid is read.
     :param bandwidth: float, 'silverman', 'cv' or None
     :param levels:
+    :param pyramid: dict[sigma] = pdf np.array, the pdf convolved with
+        a Gaussian peak error of sigma ppm, see blur
     """
 
-    def __init__(self, pdf, grid, bandwidth=None, levels=None):
-        self.pdf = np.array(pdf)
-        self.grid = np.array(grid)
+    __slots__ = ('_pdf', '_axes', 'bandwidth', 'levels', 'pyramid',
+                 '_interpolator', '_cdf', '_flat_cdf')
+
+    def __init__(self, pdf, grid, bandwidth=None, levels=None, pyramid=None):
+        self.pdf = pdf
+        if self.dims not in (1, 2):
+            raise ValueError('Only 1D or 2D data is acceded!')
+
+        self.grid = grid
         self.bandwidth = bandwidth
-        self.dims = np.ndim(pdf)
         self.levels = levels
+        for sigma, blurred in (pyramid or {}).items():
+            self.pyramid[float(sigma)] = Continuous(blurred, self.axes)
+
+    @property
+    def pdf(self):
+        return self._pdf
+
+    @pdf.setter
+    def pdf(self, pdf):
+        self._pdf = np.array(pdf)
+        self._interpolator = None
+        self._cdf = None
+        self._flat_cdf = None
+        self.pyramid = dict()
+
+    @property
+    def dims(self):
+        return self._pdf.ndim
 
+    @property
+    def axes(self):
+        """Grid points along each axis: (x, ) in 1D, (x, y) in 2D."""
+        return self._axes
+
+    @property
+    def grid(self):
+        """np.array(x) in 1D, np.array(np.meshgrid(x, y)) in 2D."""
+        if self.dims == 1:
+            return self._axes[0]
+        return np.array(np.meshgrid(*self._axes))
+
+    @grid.setter
+    def grid(self, grid):
         if self.dims == 1:
-            self.space = np.abs(self.grid[1]-self.grid[0])
-        elif self.dims == 2:
-            x_space = np.abs(self.grid[0, 0, 1]-self.grid[0, 0, 0])
-            y_space = np.abs(self.grid[1][0][0]-self.grid[1][-1][0])
-            self.space = np.array((x_space, y_space))
+            axes = (np.asarray(grid, dtype=float).ravel(), )
         else:
-            raise ValueError('Only 1D or 2D data is acceded!')
+            (x, y) = grid
+            if np.ndim(x) == 2:
+                (x, y) = (np.asarray(x)[0], np.asarray(y)[:, 0])
+            axes = (np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        self._axes = axes
+        self._interpolator = None
+        self._cdf = None
+        self.pyramid = dict()
 
     @property
-    def limits(self):
+    def space(self):
+        """
+        Grid step in 1D. In 2D the x step and the full y range, which
+        is what the 2D scores have always been divided by.
+        """
         if self.dims == 1:
-            return np.array([self.grid.min(), self.grid.max()])
-        else:
-            min_x = self.grid[0][0:1].min()
-            max_x = self.grid[0][0:1].max()
+            x = self._axes[0]
+            return np.abs(x[1] - x[0])
+        (x, y) = self._axes
+        return np.array((np.abs(x[1] - x[0]), np.abs(y[0] - y[-1])))
 
-            min_y = self.grid[1][:, 0].min()
-            max_y = self.grid[1][:, 0].max()
+    @property
+    def interpolator(self):
+        """
+        Interpolating function of the PDF. Fitting it is much slower
+        than evaluating it, so it is built on first use and kept until
+        pdf or grid are reassigned.
+        """
+        if self._interpolator is None:
+            from scipy.interpolate import interp1d, RectBivariateSpline
+
+            if self.dims == 1:
+                self._interpolator = interp1d(
+                    self._axes[0], self.pdf, bounds_error=False,
+                    fill_value=0.0)
+            else:
+                self._interpolator = RectBivariateSpline(
+                    self._axes[1], self._axes[0], self.pdf)
+        return self._interpolator
 
-            return np.array([[min_x, max_x], [min_y, max_y]])
+    @property
+    def limits(self):
+        limits = np.array([[x.min(), x.max()] for x in self._axes])
+        if self.dims == 1:
+            return limits[0]
+        return limits
 
     @property
     def grid_str(self):
@@ -81,43 +144,163 @@ class Continuous(object):
 
         return np.array(limits + shape)
 
+    @property
+    def steps(self):
+        """Grid step along each axis in ppm."""
+        limits = self.limits.reshape((-1, 2))
+        shape = np.array(self.pdf.shape[::-1])
+        return (limits[:, 1] - limits[:, 0]) / (shape - 1)
+
+    def blur(self, sigma):
+        """
+        The PDF convolved with a Gaussian peak error, kept in the
+        pyramid so each sigma is only computed once.
+
+        :param sigma: float, standard deviation in ppm along every axis
+        :rtype: Continuous
+        """
+        sigma = float(sigma)
+        if sigma not in self.pyramid:
+            self.pyramid[sigma] = self._blurred(sigma)
+        return self.pyramid[sigma]
+
+    def _blurred(self, sigma):
+        """The PDF blurred with sigma, not kept in the pyramid."""
+        return Continuous(gaussian_blur(self.pdf, self.steps, sigma),
+                          self.axes)
+
     @property
     def cdf(self):
-        if self.dims == 1:
-            return np.cumsum(self.pdf) * self.space
+        """
+        Cumulative distribution on the grid, in 2D the probability of
+        x and y both being at or below the grid point. Computed on
+        first use and kept until pdf or grid are reassigned.
+        """
+        if self._cdf is None:
+            if self.dims == 1:
+                self._cdf = np.cumsum(self.pdf) * self.space
+            else:
+                self._cdf = (np.cumsum(np.cumsum(self.pdf, axis=0), axis=1) *
+                             np.prod(self.steps))
+        return self._cdf
 
+    def random_sample(self, n, rng=None):
+        """
+        Draws chemical shifts from the PDF. Grid points are picked by
+        inverting the cumulative sum of the flattened PDF and each
+        draw is spread uniformly over the cell around its point.
+
+        :param n: int, number of samples
+        :param rng: None, an int seed, np.random.RandomState or
+            np.random.Generator
+        :return: np.array (n, ) in 1D or (n, 2) of (x, y) in 2D
+        """
+        if rng is None or isinstance(rng, (int, np.integer)):
+            rng = np.random.RandomState(rng)
+        if self._flat_cdf is None:
+            flat_cdf = np.cumsum(self.pdf.ravel())
+            if not flat_cdf[-1] > 0:
+                raise ValueError('The PDF is zero everywhere.')
+            self._flat_cdf = flat_cdf / flat_cdf[-1]
+
+        ind = np.searchsorted(self._flat_cdf, rng.uniform(size=n),
+                              side='right')
+        ind = np.minimum(ind, len(self._flat_cdf) - 1)
+        jitter = rng.uniform(-0.5, 0.5, size=(n, self.dims)) * self.steps
+
+        if self.dims == 1:
+            return self.axes[0][ind] + jitter[:, 0]
         else:
-            raise NotImplementedError
+            iy, ix = np.unravel_index(ind, self.pdf.shape)
+            return np.column_stack([self.axes[0][ix],
+                                    self.axes[1][iy]]) + jitter
+
+    def score(self, data, mode='spline', sigma=None):
+        """
+        Evaluates the PDF at one or many points, outside of the grid
+        the 1D PDF is 0.
+
+        :param data: float or (n, ) array for 1D, (x, y) or (n, 2)
+            array for 2D
+        :param mode: 'spline' to use the interpolator or 'linear' to
+            interpolate directly on the regular grid described by
+            grid_str. In 'linear' mode points outside of the grid
+            score 0 in 2D as well.
+        :param sigma: float, Gaussian uncertainty of the points in ppm,
+            see blur. Between two pyramid levels the scores are
+            interpolated linearly in sigma.
+        :raises ValueError: if sigma is below 0 or above
+            max_blur_sigma
+        """
+        if sigma:
+            return _pyramid_score(self, data, mode, sigma)
+
+        if mode == 'linear':
+            return self._score_linear(data)
+        elif mode != 'spline':
+            raise ValueError("mode should be 'spline' or 'linear'")
 
-    def score(self, data):
+        f = self.interpolator
         if self.dims == 1:
-            f = interp1d(self.grid, self.pdf)
-            return f(data)* (1/self.space)
+            return f(data) * (1/self.space)
 
         else:
-            f = RectBivariateSpline(self.grid[1][:, 0], self.grid[0][0:1],
-                                    self.pdf)
             data = np.array(data)
             if data.ndim == 1:
                 return f.ev(data[1], data[0]) * 1/np.prod(self.space)
             else:
                 return f.ev(data[:, 1], data[:, 0]) * 1/np.prod(self.space)
 
-    def get_levels(self, data=None, *percentiles, **kwargs):
+    def _score_linear(self, data):
         """
-        Returns the levels (or limits) of the chemical shift range at a chosen
-        confidence level. Done by randomly sampling the PDF.
+        Linear (1D) or bilinear (2D) interpolation, the grid indices
+        are computed from the limits and shape of the grid.
         """
+        params = self.grid_str
+        data = np.asarray(data, dtype=float)
+
+        if self.dims == 1:
+            ind, t, outside = _grid_position(
+                data, params[0], params[1], self.pdf.shape[0])
+            pdf = self.pdf[ind] * (1 - t) + self.pdf[ind + 1] * t
+            return np.where(outside, 0.0, pdf) * (1/self.space)
 
-        if data is None:
-            try:
-                n = kwargs['n']
-            except KeyError:
-                n = 1000
-            data = self.random_sample(n)
         else:
-            n = len(data)
+            ny, nx = self.pdf.shape
+            x_ind, tx, x_out = _grid_position(
+                data[..., 0], params[0], params[1], nx)
+            y_ind, ty, y_out = _grid_position(
+                data[..., 1], params[2], params[3], ny)
+
+            pdf = (self.pdf[y_ind, x_ind] * (1 - tx) * (1 - ty) +
+                   self.pdf[y_ind, x_ind + 1] * tx * (1 - ty) +
+                   self.pdf[y_ind + 1, x_ind] * (1 - tx) * ty +
+                   self.pdf[y_ind + 1, x_ind + 1] * tx * ty)
+            pdf = np.where(x_out | y_out, 0.0, pdf)
+            return pdf * 1/np.prod(self.space)
+
+    def get_levels(self, data=None, *percentiles):
+        """
+        Returns the levels (or limits) of the chemical shift range at a
+        chosen confidence level, one per percentile. In 1D the limits
+        are (min, max) ppm, in 2D the level is the PDF value to contour
+        self.pdf at.
+
+        Without data the highest density region of the gridded PDF is
+        used: the grid values are sorted, their cumulative mass gives
+        every percentile with one search. With data the levels are
+        those of the points scoring highest.
+
+        :param data: None or the data the PDF was estimated from
+        :param percentiles: confidence levels in percent
+        """
+
+        if data is None:
+            for level in self._grid_levels(percentiles):
+                yield level
+            return
 
+        n = len(data)
         if self.dims == 1:
             data = np.array(data).flatten()
             scores = self.score(data)
@@ -129,32 +312,314 @@ class Continuous(object):
                 yield data[ind:].min(), data[ind:].max()
 
         else:
-            scores = self.score(data)
+            scores = self.score(data) * np.prod(self.space)
 
             for percentile in percentiles:
                 alpha = 100-percentile
                 yield np.percentile(scores, alpha)
 
+    def _grid_levels(self, percentiles):
+        """Highest density levels of the gridded PDF, see get_levels."""
+        values = np.sort(self.pdf.ravel())[::-1]
+        mass = np.cumsum(values)
+        fractions = np.asarray(percentiles, dtype=float) / 100.0
+        ind = np.searchsorted(mass, fractions * mass[-1])
+        thresholds = values[np.minimum(ind, len(values) - 1)]
+
+        if self.dims == 2:
+            return list(thresholds)
+
+        limits = []
+        for threshold in thresholds:
+            inside = self.axes[0][self.pdf >= threshold]
+            limits.append((inside.min(), inside.max()))
+        return limits
+
     def mode(self):
         if self.dims == 1:
             index = np.argmax(self.pdf)
-            position = self.grid[index]
+            position = self.axes[0][index]
         else:
-            index = np.unravel_index(self.pdf.argmax(), self.pdf.shape)
-            position = [self.grid[x][index] for x in [0, 1]]
+            (iy, ix) = np.unravel_index(self.pdf.argmax(), self.pdf.shape)
+            position = [self.axes[0][ix], self.axes[1][iy]]
         return position
 
 
-# Functions for estimating PDF
-def estimate_pdf(data, grid=None, bandwidth=None, params=None, **kwargs):
+class ContinuousStack(object):
+    """
+    The PDFs of one correlation in each secondary structure stacked in
+    one array, so all of them are scored with a single call. The PDF
+    files give every secondary structure its own grid, so each layer
+    keeps its own limits and shape. The layers are stored back to back
+    in one flat array and the pdf of every Continuous is made a view
+    into it, so the densities are only held once.
+
+    :param smooths: list of Continuous, or None where there is no PDF,
+        normally in the order of stack_sndstr
     """
+    def __init__(self, smooths):
+        present = [x for x in smooths if x is not None]
+        if not present:
+            raise ValueError('A stack needs at least one PDF.')
+
+        self.dims = present[0].dims
+        n = len(smooths)
+
+        self.missing = np.array([x is None for x in smooths])
+        # Limits and number of points along x (and y) of every layer.
+        self.limits = np.tile([0.0, 1.0], (n, self.dims, 1))
+        self.shape = np.full((n, self.dims), 2, dtype=int)
+        self.scale = np.ones(n)
+
+        # A missing layer is a 2 (x 2) block of zeros.
+        layers = [np.zeros((2, ) * self.dims) if x is None else x.pdf
+                  for x in smooths]
+        sizes = [x.size for x in layers]
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(int)
+        self._values = np.concatenate([x.ravel() for x in layers])
+
+        for k, smooth in enumerate(smooths):
+            if smooth is None:
+                continue
+            # Same values, so the caches of smooth stay valid.
+            smooth._pdf = self._values[
+                offsets[k]:offsets[k] + sizes[k]].reshape(smooth.pdf.shape)
+            self.limits[k] = smooth.limits.reshape((self.dims, 2))
+            self.shape[k] = smooth.pdf.shape[::-1]
+            self.scale[k] = 1/np.prod(smooth.space)
+        self.smooths = smooths
+
+        # Blurred stacks for the sigmas every layer has stored.
+        self.pyramid = dict()
+        for sigma in set.intersection(*[set(x.pyramid) for x in present]):
+            self.blur(sigma)
+
+        # Grid parameters per axis, shaped (layers, 1) to broadcast
+        # against the points, and the strides of the flattened stack.
+        low, high = self.limits[:, :, 0], self.limits[:, :, 1]
+        self._low = low.T[:, :, None]
+        self._scale_to = ((self.shape - 1) / (high - low)).T[:, :, None]
+        self._last = (self.shape - 1).T[:, :, None]
+        self._strides = [1] if self.dims == 1 else [1, self.shape[:, :1]]
+        self._offsets = offsets[:, None]
+        self._scale = self.scale[:, None]
+
+    def blur(self, sigma):
+        """
+        Stack of the layers blurred with a Gaussian peak error, see
+        Continuous.blur.
 
-    :param data:
-    :param bandwidth:
-    :param cv_params:
-    :param kwargs:
-    :return:
+        :param sigma: float, standard deviation in ppm
+        :rtype: ContinuousStack
+        """
+        sigma = float(sigma)
+        if sigma not in self.pyramid:
+            self.pyramid[sigma] = ContinuousStack(
+                [None if x is None else x.blur(sigma) for x in self.smooths])
+        return self.pyramid[sigma]
+
+    def _blurred(self, sigma):
+        """The stack blurred with sigma, not kept in any pyramid."""
+        return ContinuousStack([None if x is None else x._blurred(sigma)
+                                for x in self.smooths])
+
+    def score(self, data, mode='spline', sigma=None):
+        """
+        Evaluates every layer at one or many points.
+
+        :param data: float or (n, ) array for 1D, (x, y) or (n, 2)
+            array for 2D
+        :param mode: 'spline' or 'linear', see Continuous.score. The
+            1D interpolator of Continuous is linear, so in 1D both
+            modes are scored directly on the stacked array.
+        :param sigma: float, Gaussian uncertainty of the points in ppm,
+            see Continuous.score
+        :return: np.array with shape (layers, ) + points shape, nan
+            for the layers without a PDF
+        """
+        if mode not in ('spline', 'linear'):
+            raise ValueError("mode should be 'spline' or 'linear'")
+        if sigma:
+            return _pyramid_score(self, data, mode, sigma)
+
+        data = np.asarray(data, dtype=float)
+        if self.dims == 2 and mode == 'spline':
+            points = data.shape[:-1]
+            scores = np.array([np.zeros(points) if x is None else
+                               x.score(data) for x in self.smooths])
+        else:
+            scores = self._score_linear(data)
+
+        if self.missing.any():
+            scores[self.missing] = np.nan
+        return scores
+
+    def _score_linear(self, data):
+        """
+        Continuous._score_linear broadcast over the layers, the values
+        are read from the flattened stack.
+        """
+        points = data.shape if self.dims == 1 else data.shape[:-1]
+        data = data.reshape((-1, self.dims))
+
+        flat = self._offsets
+        outside = False
+        fractions = []
+        for axis in range(self.dims):
+            # Grid position with shape (layers, n) along one axis.
+            position = (data[:, axis] - self._low[axis]) * self._scale_to[axis]
+            ind = position.astype(int)
+            np.minimum(ind, self._last[axis] - 1, out=ind)
+            np.maximum(ind, 0, out=ind)
+            outside = outside | (position < 0) | (position > self._last[axis])
+            # Fractions off the grid are not clipped, they are masked.
+            fractions.append(position - ind)
+            flat = flat + ind * self._strides[axis]
+
+        pdf = self._values
+        if self.dims == 1:
+            t = fractions[0]
+            value = pdf[flat] * (1 - t) + pdf[flat + 1] * t
+        else:
+            tx, ty = fractions
+            x_step, y_step = self._strides
+            value = (pdf[flat] * (1 - tx) * (1 - ty) +
+                     pdf[flat + x_step] * tx * (1 - ty) +
+                     pdf[flat + y_step] * (1 - tx) * ty +
+                     pdf[flat + x_step + y_step] * tx * ty)
+
+        value[outside] = 0.0
+        value *= self._scale
+        return value.reshape((len(self.smooths), ) + points)
+
+    def __len__(self):
+        return len(self.smooths)
+
+
+# Pyramid levels (ppm) made on first use for PDFs stored without one.
+default_blur_sigmas = (0.1, 0.25, 0.5)
+
+# Largest peak uncertainty (ppm) accepted by score, it bounds the size
+# of the blur kernel.
+max_blur_sigma = 2.0
+
+
+def _pyramid_score(smooth, data, mode, sigma):
+    """
+    Scores with the pyramid level of sigma, or between the two levels
+    around it. Above the top level the blurred PDF is made for this
+    call only.
+    """
+    sigma = float(sigma)
+    if not 0 <= sigma <= max_blur_sigma:
+        mesg = 'sigma should be from 0 to {} ppm, not {}'.format(
+            max_blur_sigma, sigma)
+        raise ValueError(mesg)
+
+    if not smooth.pyramid:
+        for level in default_blur_sigmas:
+            smooth.blur(level)
+    if sigma in smooth.pyramid:
+        return smooth.pyramid[sigma].score(data, mode)
+    if sigma > max(smooth.pyramid):
+        # Not kept, sigma can come from a client of a long-running
+        # server.
+        return smooth._blurred(sigma).score(data, mode)
+
+    lower = max([x for x in smooth.pyramid if x < sigma] + [0.0])
+    upper = min(x for x in smooth.pyramid if x > sigma)
+    weight = (sigma - lower) / (upper - lower)
+
+    low_score = smooth.score(data, mode, lower)
+    return ((1 - weight) * low_score +
+            weight * smooth.pyramid[upper].score(data, mode))
+
+
+def gaussian_blur(pdf, steps, sigma):
+    """
+    Convolves a 1D or 2D PDF with a normalized Gaussian using the FFT.
+    The PDF is zero padded so nothing wraps around, the probability
+    blurred past the edges of the grid is lost.
+
+    :param pdf: np.array on a regular grid
+    :param steps: grid step along each axis in ppm, x first
+    :param sigma: float, standard deviation in ppm
+    :return: np.array like pdf
+    """
+    pdf = np.asarray(pdf, dtype=float)
+    if sigma <= 0:
+        return pdf.copy()
+
+    kernel = _gaussian_kernel(steps, sigma, 4)
+    return np.clip(_convolve_same(pdf, kernel / kernel.sum()), 0, None)
+
+
+def _gaussian_kernel(steps, sigma, truncate):
+    """
+    Unnormalized Gaussian on the grid nodes within truncate * sigma of
+    the center, axes ordered like a pdf array (y first).
+
+    :param steps: grid step along each axis in ppm, x first
+    """
+    kernel = None
+    for step in np.ravel(steps)[::-1]:
+        half = int(np.ceil(truncate * sigma / step))
+        x = np.arange(-half, half + 1) * step
+        axis = np.exp(-x**2 / (2.0 * sigma**2))
+        kernel = axis if kernel is None else np.multiply.outer(kernel, axis)
+    return kernel
+
+
+def _convolve_same(array, kernel):
+    """
+    FFT convolution of an array with an odd sized kernel, zero padded
+    so nothing wraps around and cropped to the shape of the array.
+    """
+    shape = [n + k - 1 for n, k in zip(array.shape, kernel.shape)]
+    axes = list(range(array.ndim))
+    full = np.fft.irfftn(np.fft.rfftn(array, shape, axes) *
+                         np.fft.rfftn(kernel, shape, axes), shape, axes)
+
+    cut = tuple(slice(k // 2, k // 2 + n)
+                for n, k in zip(array.shape, kernel.shape))
+    return full[cut]
+
+
+def _grid_position(values, low, high, n):
+    """
+    Cell index and fractional offset of values on a regular grid of n
+    points from low to high, and a mask of the values off the grid.
     """
+    position = (values - low) / (high - low) * (n - 1)
+    outside = (position < 0) | (position > n - 1)
+
+    ind = np.clip(np.floor(position), 0, n - 2).astype(int)
+    t = np.clip(position - ind, 0.0, 1.0)
+    return ind, t, outside
+
+
+# Functions for estimating PDF
+def estimate_pdf(data, grid=None, bandwidth=None, params=None,
+                 method='sklearn', **kwargs):
+    """
+    Gaussian kernel density estimate of 1D or 2D data on a grid.
+
+    :param data: np.array (n, 1) or (n, 2)
+    :param grid: np.array(x) or np.meshgrid(x, y), default a grid over
+        the data (or kwargs['limits']) from make_grid
+    :param bandwidth: float or the estimation_type of
+        estimate_bandwidth
+    :param params: candidate bandwidths for estimate_bandwidth
+    :param method: 'sklearn' to evaluate every kernel at every grid
+        point or 'binned' to bin the data onto the grid and convolve
+        with the kernel, see binned_kde. 'binned' needs a regular grid.
+    :param kwargs: limits, bandwidth_sample and estimate_bandwidth
+        options
+    :rtype: Continuous
+    """
+
+    if method not in ('sklearn', 'binned'):
+        raise ValueError("method should be 'sklearn' or 'binned'")
 
     data = np.array(data)
 
@@ -173,7 +638,7 @@ def estimate_pdf(data, grid=None, bandwidth=None, params=None, **kwargs):
         try:
             limits = kwargs['limits']
         except KeyError:
-            limits = zip(np.min(data, axis=0),  np.max(data, axis=0))
+            limits = list(zip(np.min(data, axis=0),  np.max(data, axis=0)))
             if dims == 1:
                 limits = limits[0]
         try:
@@ -183,7 +648,12 @@ def estimate_pdf(data, grid=None, bandwidth=None, params=None, **kwargs):
 
         grid = make_grid(limits, bandwidth, bandwidth_sample)
 
+    if method == 'binned':
+        return Continuous(binned_kde(data, grid, bandwidth), grid, bandwidth)
+
     # Kernel Density Estimation
+    from sklearn.neighbors import KernelDensity
+
     kde = KernelDensity(bandwidth=bandwidth).fit(data)
 
     # Score grid to generate PDF
@@ -200,11 +670,92 @@ def estimate_pdf(data, grid=None, bandwidth=None, params=None, **kwargs):
     return Continuous(np.exp(log_pdf), grid, bandwidth)
 
 
+def binned_kde(data, grid, bandwidth, truncate=5):
+    """
+    Gaussian kernel density estimate on a regular grid in
+    O(n_data + n_grid log n_grid). Each point is split linearly
+    between the two (1D) or four (2D) grid nodes around it and the
+    counts are convolved with the kernel using the FFT. The grid is
+    extended by truncate bandwidths for the binning so data just off
+    the grid still contributes, data further out is dropped.
+
+    :param data: np.array (n, 1) or (n, 2)
+    :param grid: np.array(x) or np.meshgrid(x, y) of evenly spaced
+        points, at least 2 along each axis
+    :param bandwidth: float, standard deviation of the kernel in ppm
+    :param truncate: float, kernel support in bandwidths
+    :return: np.array of densities shaped like the grid, the same
+        quantity as exp(KernelDensity.score_samples)
+    """
+    data = np.asarray(data, dtype=float)
+    data = data.reshape((len(data), -1))
+    dims = data.shape[1]
+
+    if dims == 1:
+        axes = [np.ravel(grid)]
+    else:
+        axes = [np.asarray(grid[0])[0], np.asarray(grid[1])[:, 0]]
+    if min(len(x) for x in axes) < 2:
+        raise ValueError('A binned KDE needs 2 grid points along each axis.')
+    steps = np.array([(x[-1] - x[0]) / (len(x) - 1.0) for x in axes])
+
+    # Grid extended by pad nodes on each side, x first.
+    pads = [int(np.ceil(truncate * bandwidth / x)) for x in steps]
+    sizes = [len(x) + 2 * n for x, n in zip(axes, pads)]
+    lows = [x[0] - n * step for x, n, step in zip(axes, pads, steps)]
+
+    cell, t = _grid_cells(data, lows, steps)
+    keep = np.all((cell >= 0) & (cell < np.array(sizes) - 1), axis=1)
+    counts = _linear_bin(cell[keep], t[keep], sizes)
+
+    kernel = _gaussian_kernel(steps, bandwidth, truncate)
+    kernel /= (np.sqrt(2 * np.pi) * bandwidth)**dims * len(data)
+
+    density = _convolve_same(counts, kernel)
+    cut = tuple(slice(n, n + len(x)) for x, n in zip(axes, pads))[::-1]
+    return np.clip(density[cut], 0, None)
+
+
+def _grid_cells(data, lows, steps):
+    """
+    Lower grid node of each point and its fractional position in the
+    cell, along each axis (x first).
+    """
+    position = (data - lows) / steps
+    cell = np.floor(position).astype(int)
+    return cell, position - cell
+
+
+def _corners(cell, t, sizes):
+    """
+    Flat index into a (y, x) array of sizes[::-1] and linear weight of
+    each grid node around the points, one corner at a time.
+    """
+    dims = cell.shape[1]
+    for corner in range(2**dims):
+        offset = [(corner >> k) & 1 for k in range(dims)]
+        weight = np.prod(np.where(offset, t, 1 - t), axis=1)
+        index = cell[:, 0] + offset[0]
+        if dims == 2:
+            index = index + (cell[:, 1] + offset[1]) * sizes[0]
+        yield index, weight
+
+
+def _linear_bin(cell, t, sizes):
+    """Counts of points split linearly between their grid nodes."""
+    counts = np.zeros(int(np.prod(sizes)))
+    for index, weight in _corners(cell, t, sizes):
+        counts += np.bincount(index, weight, minlength=len(counts))
+    return counts.reshape(sizes[::-1])
+
+
 def estimate_bandwidth(data, estimation_type='cv', params=None, **kwargs):
     """
 
     :param data:
-    :param estimation_type:
+    :param estimation_type: 'silverman' for Silverman's rule, 'loo' for
+        the binned leave-one-out likelihood of likelihood_search or
+        'cv' for the cross validation of grid_search
     :param params:
     :param kwargs:
     :return:
@@ -212,6 +763,8 @@ def estimate_bandwidth(data, estimation_type='cv', params=None, **kwargs):
 
     if estimation_type == 'silverman':
         return silverman(data)
+    elif estimation_type == 'loo':
+        return likelihood_search(data, params)
     else:
         return grid_search(data, params, **kwargs)
 
@@ -239,11 +792,79 @@ def grid_search(data, params=None, **kwargs):
     if not params:
         params = {'bandwidth': np.linspace(0.3, 1.5, 15)}
 
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.neighbors import KernelDensity
+
     search = GridSearchCV(KernelDensity(), params, **kwargs)
     search.fit(data)
     return search.best_estimator_.bandwidth
 
 
+def likelihood_search(data, params=None, bins_per_bandwidth=4,
+                      max_nodes=512, truncate=4):
+    """
+    Bandwidth with the largest leave-one-out log likelihood. The data
+    is binned once onto a grid with bins_per_bandwidth nodes per
+    smallest candidate bandwidth and its FFT is reused for every
+    candidate, so each bandwidth costs one FFT convolution instead of
+    a KDE fit per fold. The binned contribution of each point to its
+    own density is removed exactly.
+
+    :param data: np.array (n, 1) or (n, 2)
+    :param params: dict with a 'bandwidth' list of candidates, as for
+        grid_search
+    :param bins_per_bandwidth: int, grid nodes per smallest bandwidth
+    :param max_nodes: int, most grid nodes along an axis, coarser
+        binning is used for very small bandwidths over wide data
+    :param truncate: float, kernel support in bandwidths
+    :return: float, the best candidate
+    """
+    data = np.asarray(data, dtype=float)
+    data = data.reshape((len(data), -1))
+    (n, dims) = data.shape
+    if n < 2:
+        raise ValueError('Leave-one-out needs at least 2 data points.')
+
+    if not params:
+        params = {'bandwidth': np.linspace(0.3, 1.5, 15)}
+    bandwidths = np.ravel(params['bandwidth']).astype(float)
+
+    lows = data.min(axis=0)
+    step = max(bandwidths.min() / bins_per_bandwidth,
+               (data.max(axis=0) - lows).max() / (max_nodes - 2))
+    steps = np.full(dims, step)
+    sizes = [int(x) + 2 for x in (data.max(axis=0) - lows) / step]
+    cell, t = _grid_cells(data, lows, steps)
+    counts = _linear_bin(cell, t, sizes)
+    corners = list(_corners(cell, t, sizes))
+
+    # Common FFT shape for the largest kernel.
+    half = int(np.ceil(truncate * bandwidths.max() / step))
+    shape = [x + 2 * half for x in counts.shape]
+    axes = list(range(dims))
+    counts_fft = np.fft.rfftn(counts, shape, axes)
+
+    likelihood = []
+    for bandwidth in bandwidths:
+        kernel = _gaussian_kernel(steps, bandwidth, truncate)
+        full = np.fft.irfftn(counts_fft * np.fft.rfftn(kernel, shape, axes),
+                             shape, axes)
+        cut = tuple(slice(k // 2, k // 2 + x)
+                    for x, k in zip(counts.shape, kernel.shape))
+        sums = full[cut].ravel()
+        total = sum(weight * sums[index] for index, weight in corners)
+
+        # Kernel between the binned copies of each point and itself.
+        near = np.exp(-step**2 / (2.0 * bandwidth**2))
+        own = np.prod(t**2 + (1 - t)**2 + 2 * t * (1 - t) * near, axis=1)
+
+        density = (total - own) / (
+            (n - 1) * (np.sqrt(2 * np.pi) * bandwidth)**dims)
+        likelihood.append(np.log(np.maximum(density, 1e-300)).sum())
+
+    return bandwidths[int(np.argmax(likelihood))]
+
+
 def silverman(data):
     """
     Normal distribution approximation i.e. Silverman's rule of thumb.
@@ -289,8 +910,14 @@ standard_experiments = {'cc': CSExperiment(('C', 'C'), bonds=1),
 
 
 def make_pdf(exp, pacsy, file_name, seq=None, confidence_levels=[68, 80, 95],
-             verbose=True):
+             verbose=True, blur_sigmas=None):
     """
+    Estimates the PDF of every correlation of an experiment and saves
+    them with their grids and ranges to a hdf5 file.
+
+    :param blur_sigmas: list of float, if given the PDFs blurred with
+        Gaussian peak errors of these sigmas (ppm) are saved as well,
+        for example [0.1, 0.25, 0.5], see Continuous.blur
     """
 
     from pluq.dbtools import PacsyCorrelation
@@ -316,9 +943,11 @@ def make_pdf(exp, pacsy, file_name, seq=None, confidence_levels=[68, 80, 95],
 
         try:
             if exp.dims == 1:
-                smooth = estimate_pdf(data, bandwidth='silverman')
+                smooth = estimate_pdf(data, bandwidth='silverman',
+                                      method='binned')
             else:
-                smooth = estimate_pdf(data, bandwidth='silverman')
+                smooth = estimate_pdf(data, bandwidth='silverman',
+                                      method='binned')
                 # smooth = estimate_pdf(
                 #     data, bandwidth=None,
                 #     params={'bandwidth': np.linspace(0.4, 1.5, 15)})
@@ -329,8 +958,13 @@ def make_pdf(exp, pacsy, file_name, seq=None, confidence_levels=[68, 80, 95],
         try:
             h5f['{}'.format(str(corr))] = smooth.pdf
             h5f['{},x'.format(str(corr))] = smooth.grid_str
-            levels = list(smooth.get_levels(data, *confidence_levels))
+            levels = list(smooth.get_levels(None, *confidence_levels))
             h5f['{},levs'.format(str(corr))] = levels
+            if blur_sigmas:
+                pyramid = [smooth.blur(x).pdf for x in blur_sigmas]
+                h5f['{},blur'.format(str(corr))] = np.array(pyramid)
+                h5f['{},blur'.format(str(corr))].attrs['sigmas'] = \
+                    np.array(blur_sigmas, dtype=float)
         except:
             catch.append(corrs)
             continue
@@ -369,9 +1003,47 @@ def get_pdf(corr, pdf_dict):
     else:
         x_grid = np.linspace(x_params[0], x_params[1], int(x_params[-1]))
         y_grid = np.linspace(x_params[2], x_params[3], int(x_params[-2]))
-        grid = np.meshgrid(x_grid, y_grid)
+        grid = (x_grid, y_grid)
 
-    return Continuous(pdf, grid, levels=levels)
+    pyramid = None
+    if corr + ',blur' in pdf_dict:
+        blurred = pdf_dict[corr + ',blur']
+        pyramid = dict(zip(blurred.attrs['sigmas'], np.array(blurred)))
+
+    return Continuous(pdf, grid, levels=levels, pyramid=pyramid)
+
+
+# Secondary structures in a ContinuousStack: all, helix, coil, sheet.
+stack_sndstr = ('X', 'H', 'C', 'E')
+
+
+def get_pdf_stack(corr, pdf_dict, load=None):
+    """
+    Reads the PDFs of a correlation in every secondary structure into
+    one ContinuousStack, the secondary structure of corr is ignored.
+
+    :param corr: Correlation
+    :param pdf_dict: h5py file from read_pdf
+    :param load: function(Correlation) returning a Continuous or
+        raising KeyError, for example a cached get_pdf, default reads
+        from pdf_dict
+    :rtype: ContinuousStack
+    :raises KeyError: if there is no PDF for any secondary structure
+    """
+    if load is None:
+        load = lambda x: get_pdf(x, pdf_dict)
+
+    smooths = []
+    for ss in stack_sndstr:
+        try:
+            smooths.append(load(Correlation(corr.aa, corr.atoms, ss)))
+        except KeyError:
+            smooths.append(None)
+
+    try:
+        return ContinuousStack(smooths)
+    except ValueError:
+        raise KeyError(str(corr))
 
 
 # Functions for making, saving, and manipulating regions.
@@ -399,6 +1071,8 @@ def make_region(exp_type, file_name, corrs, verbose=True):
     else:
         file_operation = 'w'
 
+    import fiona
+
     stype = 'ESRI Shapefile'
     with fiona.open(file_name, file_operation, stype, schema) as shp:
         for corr in corrs:
@@ -425,13 +1099,41 @@ def make_region(exp_type, file_name, corrs, verbose=True):
                     print(corr)
 
 
+def make_region_raster(exp_type, file_name=None, levels=(68, 80, 95),
+                       step=0.05):
+    """
+    Rasterizes the regions of an experiment, every level on one shared
+    grid, and saves them for fast lookups with fileio.read_region_raster.
+
+    :param exp_type: experiment name str in fileio.shapefile_exptype
+    :param file_name: str, default is the file read_region_raster uses
+    :param levels: confidence levels to rasterize
+    :param step: float, cell size in ppm
+    :return: dict[level] = pluq.index.RegionRaster
+    """
+    regions = {level: read_region(exp_type, level) for level in levels}
+    names = sorted(set().union(*regions.values()))
+    bounds = union_bounds([x for y in regions.values() for x in y.values()])
+
+    rasters = dict()
+    for level in levels:
+        rasters[level] = RegionRaster.from_regions(
+            regions[level], step, names=names, bounds=bounds)
+
+    if file_name is None:
+        file_name = region_raster_path(exp_type)
+    write_region_raster(file_name, rasters)
+    return rasters
+
+
 def _region(smooth, level):
     if smooth.pdf.ndim != 2:
         raise ValueError('Should be a 2D data set.')
 
-    xgrid, ygrid = smooth.grid
-    x = xgrid[0, :]
-    y = ygrid[:, 0]
+    from scipy.interpolate import interp1d
+    from skimage import measure
+
+    (x, y) = smooth.axes
 
     fx = interp1d(range(len(x)), x)
     fy = interp1d(range(len(y)), y)
@@ -0,0 +1,353 @@
+"""
+Indexes over the pre-made chemical shift ranges, used to quickly find
+which correlations could explain a resonance.
+"""
+import numpy as np
+from shapely.geometry import MultiPolygon, Point
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+try:
+    from shapely import contains_xy
+except ImportError:
+    from shapely.vectorized import contains as contains_xy
+
+
+class RegionIndex(object):
+    """
+    Spatial index over the 2D chemical shift regions of one experiment
+    at one confidence level. Candidate regions are found from their
+    bounding boxes with a STRtree and then confirmed with an exact
+    (prepared) polygon test.
+
+    :param regions: dict[correlation str] = shapely Polygon or
+        MultiPolygon, as returned by fileio.read_region
+    """
+    def __init__(self, regions):
+        self.names = sorted(regions)
+        self.geometries = [regions[x] for x in self.names]
+        self._prepared = [prep(x) for x in self.geometries]
+        self._tree = STRtree(self.geometries)
+
+        # Shapely < 2.0 returns geometries from a query, not indices.
+        self._ids = {id(x): n for n, x in enumerate(self.geometries)}
+        self._positions = {x: n for n, x in enumerate(self.names)}
+
+    def _candidates(self, point):
+        """Indices of the regions whose bounding box holds point."""
+        candidates = []
+        for item in self._tree.query(point):
+            try:
+                candidates.append(int(item))
+            except TypeError:
+                candidates.append(self._ids[id(item)])
+        return sorted(candidates)
+
+    def query(self, resonance):
+        """
+        Correlations with a region containing the resonance.
+
+        :param resonance: (x, y) chemical shifts
+        :return: [correlation str, ...]
+        """
+        point = Point(resonance)
+        return [self.names[n] for n in self._candidates(point)
+                if self._prepared[n].contains(point)]
+
+    def query_many(self, resonances):
+        """
+        :param resonances: iterable of (x, y) chemical shifts
+        :return: [[correlation str, ...], ...] one list per resonance
+        """
+        return [self.query(resonance) for resonance in resonances]
+
+    def contains(self, name, resonance):
+        """
+        True if the region of one correlation holds the resonance.
+
+        :param name: correlation str, False if it has no region
+        :param resonance: (x, y) chemical shifts
+        """
+        try:
+            n = self._positions[name]
+        except KeyError:
+            return False
+        return self._prepared[n].contains(Point(resonance))
+
+    def __len__(self):
+        return len(self.names)
+
+
+class IntervalIndex(object):
+    """
+    Index over the 1D chemical shift ranges of one experiment at one
+    confidence level. The ranges are kept as start and end arrays
+    sorted by start, so a lookup is a binary search followed by a
+    comparison with the ends of the ranges that start below the shift.
+
+    :param ranges: dict[correlation str] = (min, max), as returned by
+        fileio.read_ranges
+    """
+    def __init__(self, ranges):
+        names = sorted(ranges)
+        bounds = np.array([ranges[x] for x in names], dtype=float)
+        bounds = bounds.reshape((-1, 2))
+
+        order = np.argsort(bounds[:, 0], kind='mergesort')
+        self.names = [names[n] for n in order]
+        self.starts = bounds[order, 0]
+        self.ends = bounds[order, 1]
+        self._positions = {x: n for n, x in enumerate(self.names)}
+
+    def query(self, shift):
+        """
+        Correlations with a range containing the chemical shift.
+
+        :param shift: float
+        :return: [correlation str, ...]
+        """
+        return self.query_many(np.ravel(shift))[0]
+
+    def query_many(self, shifts):
+        """
+        :param shifts: array like of chemical shifts
+        :return: [[correlation str, ...], ...] one list per shift
+        """
+        shifts = np.ravel(np.asarray(shifts, dtype=float))
+        stops = np.searchsorted(self.starts, shifts, side='right')
+
+        hits = []
+        for shift, stop in zip(shifts, stops):
+            found = np.flatnonzero(self.ends[:stop] >= shift)
+            hits.append([self.names[n] for n in found])
+        return hits
+
+    def contains(self, name, shift):
+        """
+        True if the range of one correlation holds the chemical shift.
+
+        :param name: correlation str, False if it has no range
+        :param shift: float
+        """
+        try:
+            n = self._positions[name]
+        except KeyError:
+            return False
+        return bool(self.starts[n] <= shift <= self.ends[n])
+
+    def __len__(self):
+        return len(self.names)
+
+
+class RegionRaster(object):
+    """
+    Region membership looked up from a precomputed raster. The regions
+    are rasterized onto a regular ppm grid, each cell holds the id of
+    a packed bitset of the correlations whose region holds the cell.
+    Cells that a region boundary passes through are flagged and the
+    exact test of a RegionIndex is used for them instead.
+
+    :param names: sorted list of correlation str, the bit order
+    :param origin: (x, y) ppm of the lower corner of the grid
+    :param step: float, cell size in ppm
+    :param ids: np.array (ny, nx) of palette row for each cell
+    :param boundary: bool np.array (ny, nx), True for cells that need
+        the exact test
+    :param palette: uint8 np.array (n_sets, n_bytes), the bitsets
+        packed with little bit order
+    :param fallback: RegionIndex or a function returning one, used for
+        the boundary cells
+    """
+    def __init__(self, names, origin, step, ids, boundary, palette,
+                 fallback=None):
+        self.names = list(names)
+        self.origin = np.asarray(origin, dtype=float)
+        self.step = float(step)
+        self.ids = ids
+        self.boundary = boundary
+        self.palette = palette
+        self._fallback = fallback
+        self._bits = {x: n for n, x in enumerate(self.names)}
+
+    @classmethod
+    def from_regions(cls, regions, step=0.05, names=None, bounds=None,
+                     fallback=None):
+        """
+        Rasterizes the regions of one confidence level.
+
+        :param regions: dict[correlation str] = shapely Polygon or
+            MultiPolygon, as returned by fileio.read_region
+        :param step: float, cell size in ppm
+        :param names: sorted list of correlation str, lets several
+            levels share bit positions, default sorted(regions)
+        :param bounds: (min_x, min_y, max_x, max_y) of the grid, lets
+            several levels share a grid, default the region bounds
+        :param fallback: RegionIndex for the boundary cells, default
+            one is built over the regions when first needed
+        :rtype: RegionRaster
+        """
+        if names is None:
+            names = sorted(regions)
+        if bounds is None:
+            bounds = union_bounds(regions.values())
+
+        origin = np.array(bounds[:2]) - step
+        nx = int(np.ceil((bounds[2] - origin[0]) / step)) + 2
+        ny = int(np.ceil((bounds[3] - origin[1]) / step)) + 2
+
+        ids = np.zeros((ny, nx), dtype=np.uint32)
+        boundary = np.zeros((ny, nx), dtype=bool)
+        palette = [0]
+        lookup = {0: 0}
+
+        for bit, name in enumerate(names):
+            if name not in regions:
+                continue
+            region = regions[name]
+
+            # Cells whose center is in the region.
+            (x0, y0, x1, y1) = region.bounds
+            ix = np.arange(max(int((x0 - origin[0]) / step) - 1, 0),
+                           min(int((x1 - origin[0]) / step) + 2, nx))
+            iy = np.arange(max(int((y0 - origin[1]) / step) - 1, 0),
+                           min(int((y1 - origin[1]) / step) + 2, ny))
+            x_center, y_center = np.meshgrid(
+                origin[0] + (ix + 0.5) * step, origin[1] + (iy + 0.5) * step)
+            inside = contains_xy(region, x_center, y_center)
+
+            sub_ids = ids[iy[0]:iy[-1] + 1, ix[0]:ix[-1] + 1]
+            old, inverse = np.unique(sub_ids[inside], return_inverse=True)
+            new = []
+            for pid in old:
+                bitset = palette[pid] | (1 << bit)
+                if bitset not in lookup:
+                    lookup[bitset] = len(palette)
+                    palette.append(bitset)
+                new.append(lookup[bitset])
+            sub_ids[inside] = np.array(new, dtype=np.uint32)[inverse]
+
+            # Every cell within one cell of a boundary vertex, with
+            # vertices no more than step/4 apart, is a boundary cell.
+            for ring in _rings(region):
+                vertices = _densify(np.asarray(ring.coords)[:, :2], step / 4)
+                cx = np.floor((vertices[:, 0] - origin[0]) / step).astype(int)
+                cy = np.floor((vertices[:, 1] - origin[1]) / step).astype(int)
+                for dx in (-1, 0, 1):
+                    for dy in (-1, 0, 1):
+                        boundary[np.clip(cy + dy, 0, ny - 1),
+                                 np.clip(cx + dx, 0, nx - 1)] = True
+
+        n_bytes = (len(names) + 7) // 8
+        packed = np.zeros((len(palette), n_bytes), dtype=np.uint8)
+        for pid, bitset in enumerate(palette):
+            packed[pid] = np.frombuffer(
+                bitset.to_bytes(n_bytes, 'little'), dtype=np.uint8)
+
+        if len(palette) < 2**16:
+            ids = ids.astype(np.uint16)
+        if fallback is None:
+            fallback = lambda: RegionIndex(regions)
+        return cls(names, origin, step, ids, boundary, packed, fallback)
+
+    @property
+    def fallback(self):
+        """RegionIndex used for the boundary cells."""
+        if callable(self._fallback):
+            self._fallback = self._fallback()
+        return self._fallback
+
+    def cells(self, resonances):
+        """
+        Grid cell of each resonance.
+
+        :param resonances: (n, 2) array like of chemical shifts
+        :return: (iy, ix, on_grid) int arrays and a bool mask
+        """
+        resonances = np.asarray(resonances, dtype=float).reshape((-1, 2))
+        cell = np.floor((resonances - self.origin) / self.step).astype(int)
+        ny, nx = self.ids.shape
+        on_grid = ((cell[:, 0] >= 0) & (cell[:, 0] < nx) &
+                   (cell[:, 1] >= 0) & (cell[:, 1] < ny))
+        ix = np.where(on_grid, cell[:, 0], 0)
+        iy = np.where(on_grid, cell[:, 1], 0)
+        return iy, ix, on_grid
+
+    def query(self, resonance):
+        """
+        Correlations with a region containing the resonance.
+
+        :param resonance: (x, y) chemical shifts
+        :return: [correlation str, ...]
+        """
+        return self.query_many([resonance])[0]
+
+    def query_many(self, resonances):
+        """
+        :param resonances: (n, 2) array like of chemical shifts
+        :return: [[correlation str, ...], ...] one list per resonance
+        """
+        resonances = np.asarray(resonances, dtype=float).reshape((-1, 2))
+        iy, ix, on_grid = self.cells(resonances)
+        exact = on_grid & self.boundary[iy, ix]
+        ids = np.where(on_grid, self.ids[iy, ix], 0)
+
+        # Each distinct bitset is only unpacked once.
+        unique, inverse = np.unique(ids, return_inverse=True)
+        bits = np.unpackbits(self.palette[unique], axis=1, bitorder='little')
+        sets = [[self.names[n] for n in np.flatnonzero(row)] for row in bits]
+
+        hits = [list(sets[k]) for k in inverse.ravel()]
+        for k in np.flatnonzero(exact):
+            hits[k] = self.fallback.query(resonances[k])
+        return hits
+
+    def contains(self, name, resonance):
+        """
+        True if the region of one correlation holds the resonance, a
+        single bit test unless the cell is on a boundary.
+
+        :param name: correlation str, False if it has no region
+        :param resonance: (x, y) chemical shifts
+        """
+        try:
+            bit = self._bits[name]
+        except KeyError:
+            return False
+
+        iy, ix, on_grid = self.cells([resonance])
+        if not on_grid[0]:
+            return False
+        if self.boundary[iy[0], ix[0]]:
+            return self.fallback.contains(name, resonance)
+
+        packed = self.palette[self.ids[iy[0], ix[0]], bit // 8]
+        return bool((packed >> (bit % 8)) & 1)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def union_bounds(geometries):
+    """(min_x, min_y, max_x, max_y) of all the geometries."""
+    bounds = np.array([x.bounds for x in geometries])
+    return (bounds[:, 0].min(), bounds[:, 1].min(),
+            bounds[:, 2].max(), bounds[:, 3].max())
+
+
+def _rings(region):
+    """Exterior and interior rings of a Polygon or MultiPolygon."""
+    polygons = region.geoms if isinstance(region, MultiPolygon) else [region]
+    for polygon in polygons:
+        yield polygon.exterior
+        for interior in polygon.interiors:
+            yield interior
+
+
+def _densify(coords, spacing):
+    """Points along a ring no more than spacing apart."""
+    points = [coords[:1]]
+    for start, end in zip(coords[:-1], coords[1:]):
+        n = max(int(np.ceil(np.hypot(*(end - start)) / spacing)), 1)
+        t = np.arange(1, n + 1)[:, None] / float(n)
+        points.append(start + t * (end - start))
+    return np.vstack(points)
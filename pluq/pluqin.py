@@ -3,16 +3,17 @@ from __future__ import division
 from __future__ import print_function
 import collections
 from collections import namedtuple
-from itertools import compress, product
+from functools import partial
+import heapq
+import multiprocessing
 import numpy as np
-from pluq.base import Correlation
 import pluq.base as base
-import pluq.fileio as fileio
+import pluq.cache as cache
 import pluq.inbase as inbase
-from shapely.geometry import Point
 
 
-Assignment = namedtuple('Assignment', ['res', 'atoms', 'scores', 'ss_scores'])
+Assignment = namedtuple('Assignment', ['res', 'atoms', 'scores', 'ss_scores',
+                                       'level'])
 Assignment.__new__.__defaults__ = (None,) * len(Assignment._fields)
 
 
@@ -47,7 +48,7 @@ class AssignmentLine(object):
         """
         Returns the product of the scores.
         """
-        return np.product(self.scores)
+        return np.prod(self.scores)
 
     @property
     def ss_prob(self):
@@ -58,7 +59,7 @@ class AssignmentLine(object):
         ss_scores = self.ss_scores
         ss_scores = ss_scores[~np.isnan(ss_scores).any(axis=1)]
         if ss_scores.any():
-            ss_scores = np.product(ss_scores, axis=0)
+            ss_scores = np.prod(ss_scores, axis=0)
             ss_scores /= ss_scores.sum()
             ss_scores = np.round(ss_scores*100, 1)
         else:
@@ -85,8 +86,234 @@ class AssignmentLine(object):
         return ', '.join(self.list)
 
 
+def score_matrix(resonance_set, correlations, experiment_name,
+                 mode='spline', sigma=None):
+    """
+    Scores every resonance against every correlation. Each
+    correlation's PDF is evaluated for all the resonances at once.
+
+    :param resonance_set: (n_peaks, dims) array like of chemical
+        shifts
+    :param correlations: list of pluq.base.Correlation
+    :param experiment_name: one of the key from
+        inbase.standard_experiments
+    :param mode: 'spline' or 'linear', see inbase.Continuous.score
+    :param sigma: float, peak uncertainty in ppm or None, see
+        inbase.Continuous.score
+    :return: np.array with shape (n_peaks, n_correlations), nan if
+        there is no PDF for a correlation
+    """
+    peaks = _peak_array(resonance_set)
+    if peaks.shape[1] == 1:
+        peaks = peaks[:, 0]
+
+    scores = np.zeros((len(peaks), len(correlations)))
+    for n, corr in enumerate(correlations):
+        try:
+            smooth = cache.query_cache.get_pdf(corr, experiment_name)
+        except KeyError:
+            scores[:, n] = np.nan
+            continue
+        scores[:, n] = smooth.score(peaks, mode, sigma)
+    return scores
+
+
+def stack_score_matrix(resonance_set, correlations, experiment_name,
+                       mode='spline', sigma=None):
+    """
+    Scores every resonance against the X/H/C/E PDFs of every
+    correlation, each correlation's stack is evaluated for all the
+    resonances and secondary structures at once.
+
+    :param resonance_set: (n_peaks, dims) array like of chemical
+        shifts
+    :param correlations: list of pluq.base.Correlation, the secondary
+        structure is ignored
+    :param experiment_name: one of the key from
+        inbase.standard_experiments
+    :param mode: 'spline' or 'linear', see inbase.ContinuousStack.score
+    :param sigma: float, peak uncertainty in ppm or None
+    :return: np.array with shape (4, n_peaks, n_correlations) in the
+        order of inbase.stack_sndstr, nan if there is no PDF
+    """
+    peaks = _peak_array(resonance_set)
+    if peaks.shape[1] == 1:
+        peaks = peaks[:, 0]
+
+    scores = np.full((len(inbase.stack_sndstr), len(peaks),
+                      len(correlations)), np.nan)
+    for n, corr in enumerate(correlations):
+        try:
+            stack = cache.query_cache.get_pdf_stack(corr, experiment_name)
+        except KeyError:
+            continue
+        scores[:, :, n] = stack.score(peaks, mode, sigma)
+    return scores
+
+
+def get_resonance_set_choices(resonance_set, correlations,
+                              experiment_name, level=95, mode='spline',
+                              sigma=None):
+    """
+    Batch version of get_resonance_choices. The hits for all the
+    resonances are found with one index query and the X/H/C/E scores
+    come from one stacked score matrix.
+
+    :param resonance_set: list of floats or list of list of floats
+    :param correlations: list of pluq.base.Correlation
+    :param experiment_name: one of the key from
+        inbase.standard_experiments
+    :param level: int, one of the defined levels normally in
+        [68, 85, 95]
+    :param mode: 'spline' or 'linear', see inbase.Continuous.score
+    :param sigma: float, Gaussian peak uncertainty in ppm or None, see
+        inbase.Continuous.score
+    :return [dict[res] = list(Assignment, ...), ...] one dict per
+        resonance
+    """
+    _check_levels(experiment_name, [level])
+    peaks = _peak_array(resonance_set)
+
+    # Find all the hits
+    index = _range_lookup(experiment_name, level)
+    hits = index.query_many(_index_points(peaks))
+    return _assignment_sets(peaks, hits, correlations, experiment_name, mode,
+                            sigma)
+
+
+def get_resonance_set_levels(resonance_set, correlations, experiment_name,
+                             levels=None, mode='spline', sigma=None):
+    """
+    Multi-level version of get_resonance_set_choices. The hits are
+    found at the widest level with one index query and scored once,
+    only those hits are tested against the tighter levels. Every
+    Assignment's level is the tightest level whose range holds the
+    resonance.
+
+    :param resonance_set: list of floats or list of list of floats
+    :param correlations: list of pluq.base.Correlation
+    :param experiment_name: one of the key from
+        inbase.standard_experiments
+    :param levels: list of int, default every level of the experiment
+    :param mode: 'spline' or 'linear', see inbase.Continuous.score
+    :param sigma: float, Gaussian peak uncertainty in ppm or None, see
+        inbase.Continuous.score
+    :return [dict[res] = list(Assignment, ...), ...] one dict per
+        resonance
+    """
+    if levels is None:
+        pdf_dict = cache.query_cache.pdf_file(experiment_name)
+        levels = [int(x) for x in pdf_dict.attrs['confidence_levels']]
+    levels = sorted(levels)
+    _check_levels(experiment_name, levels)
+    peaks = _peak_array(resonance_set)
+    points = _index_points(peaks)
+
+    hits = _range_lookup(experiment_name, levels[-1]).query_many(points)
+
+    # The 2D regions are not always nested, so every tighter level is
+    # tested rather than stopping at the first miss.
+    inner = [(x, _range_lookup(experiment_name, x)) for x in levels[:-1]]
+    tags = []
+    for point, peak_hits in zip(points, hits):
+        peak_tags = dict()
+        for name in peak_hits:
+            peak_tags[name] = levels[-1]
+            for level, index in inner:
+                if index.contains(name, point):
+                    peak_tags[name] = level
+                    break
+        tags.append(peak_tags)
+
+    return _assignment_sets(peaks, hits, correlations, experiment_name, mode,
+                            sigma, tags)
+
+
+def get_resonance_levels(resonance, correlations, experiment_name,
+                         levels=None, mode='spline', sigma=None):
+    """
+    get_resonance_choices at every level at once, each Assignment's
+    level is the tightest level that holds the resonance, see
+    get_resonance_set_levels.
+    """
+    return get_resonance_set_levels(
+        [resonance], correlations, experiment_name, levels, mode, sigma)[0]
+
+
+def _check_levels(experiment_name, levels):
+    """Raises a ValueError if a level is not in the PDF file."""
+    pdf_dict = cache.query_cache.pdf_file(experiment_name)
+    known = list(pdf_dict.attrs['confidence_levels'])
+
+    for level in levels:
+        if level not in known:
+            mesg = 'Chose a confidence level from {}'.format(known)
+            raise ValueError(mesg)
+
+
+def _range_lookup(experiment_name, level):
+    """Cached range or region index of an experiment at one level."""
+    if inbase.standard_experiments[experiment_name].dims == 1:
+        return cache.query_cache.interval_index(experiment_name, level)
+    return cache.query_cache.region_lookup(experiment_name, level)
+
+
+def _index_points(peaks):
+    """Peaks in the form the range and region indexes take."""
+    return peaks[:, 0] if peaks.shape[1] == 1 else peaks
+
+
+def _assignment_sets(peaks, hits, correlations, experiment_name, mode,
+                     sigma=None, tags=None):
+    """
+    Scores the hits of every peak and groups them by residue.
+
+    :param peaks: (n_peaks, dims) np.array
+    :param hits: [[correlation str, ...], ...] one list per peak
+    :param tags: [dict[correlation str] = level, ...] one dict per
+        peak, or None
+    """
+    found = set(name for peak_hits in hits for name in peak_hits)
+    names = [str(x) for x in correlations]
+    columns = [n for n, name in enumerate(names) if name in found]
+    candidates = [correlations[n] for n in columns]
+
+    # Score all the hits
+    stacked = stack_score_matrix(peaks, candidates, experiment_name, mode,
+                                 sigma)
+    scores = stacked[0]
+    ss_scores = np.moveaxis(stacked[1:], 0, 2)
+
+    # A missing secondary-structure PDF drops all of them.
+    ss_missing = np.isnan(ss_scores).any(axis=2)
+
+    assignment_sets = []
+    for k, peak_hits in enumerate(hits):
+        peak_hits = set(peak_hits)
+        assignments = collections.defaultdict(list)
+        for n, corr in enumerate(candidates):
+            name = names[columns[n]]
+            if name not in peak_hits:
+                continue
+
+            corr_score = scores[k, n]
+            corr_score = 0 if np.isnan(corr_score) else float(corr_score)
+
+            if ss_missing[k, n]:
+                corr_ss_scores = None
+            else:
+                corr_ss_scores = [float(x) for x in ss_scores[k, n]]
+
+            level = None if tags is None else tags[k][name]
+            assign = Assignment(corr.aa, corr.atoms, corr_score,
+                                corr_ss_scores, level)
+            assignments[corr.aa].append(assign)
+        assignment_sets.append(assignments)
+    return assignment_sets
+
+
 def get_resonance_choices(resonance, correlations, experiment_name,
-                          level=95):
+                          level=95, mode='spline', sigma=None):
     """
     Determine which chemical shift ranges at the given confidence
     level for an experiment contain the input resonance. If so adds
@@ -100,72 +327,325 @@ def get_resonance_choices(resonance, correlations, experiment_name,
         inbase.standard_experiments
     :param level: int, one of the defined levels normally in
         [68, 85, 95]
+    :param mode: 'spline' or 'linear', see inbase.Continuous.score
+    :param sigma: float, Gaussian peak uncertainty in ppm or None, see
+        inbase.Continuous.score
     :return dict[res] = list(Assignment, ...)
     """
+    return get_resonance_set_choices(
+        [resonance], correlations, experiment_name, level, mode, sigma)[0]
 
-    pdf_dict = inbase.read_pdf(experiment_name)
-    levels = list(pdf_dict.attrs['confidence_levels'])
 
+def _peak_array(resonance_set):
+    """
+    Chemical shifts as a float array with one row per peak.
+    """
+    peaks = np.asarray(resonance_set, dtype=float)
+    return peaks.reshape((len(peaks), -1))
+
+
+def table_dtype(n):
+    """
+    NumPy structured dtype of an assignment table for n peaks: the
+    residue, the atoms and probability (%) for each peak, the joint
+    probability (%) and the H/C/E probabilities (%), nan if unknown.
+    """
+    return np.dtype([('res', 'U1'),
+                     ('atoms', object, (n, )),
+                     ('scores', float, (n, )),
+                     ('joint', float),
+                     ('ss', float, (3, ))])
+
+
+def assignment_table(assignment_sets, weights=None, top_n=None,
+                     min_joint=None):
+    """
+    Columnar assignment table sorted first by the normalized joint
+    probability and then by the sum of the normalized individual
+    probabilities.
+
+    :param assignment_sets: list of dict[res] = list(Assignment, ...),
+        from get_resonance_set_choices
+    :param weights: dict[res] = float, for example amino acid
+        fractions, or None to weight every residue the same
+    :param top_n: int, only keep the best top_n rows or None for all
+    :param min_joint: float, only keep rows with a joint probability
+        (%) above min_joint or None for all
+    :rtype: np.array with dtype table_dtype(len(assignment_sets))
+    """
+    tables = []
+    count = 0
+    for table in _ranked_groups(assignment_sets, weights, min_joint):
+        tables.append(table)
+        count += len(table)
+        if top_n is not None and count >= top_n:
+            break
+
+    if not tables:
+        return np.zeros(0, dtype=table_dtype(len(assignment_sets)))
+    return np.concatenate(tables)[:top_n]
+
+
+def iter_assignments(assignment_sets, weights=None, top_n=None,
+                     min_joint=None):
+    """
+    Generator version of assignment_table, rows are yielded in order
+    as soon as they are final.
+
+    :returns: generator of AssignmentLine.list tuples with normalized
+        probabilities
+    """
+    count = 0
+    for table in _ranked_groups(assignment_sets, weights, min_joint):
+        for row in table_rows(table):
+            if top_n is not None and count >= top_n:
+                return
+            yield row
+            count += 1
+
+
+def table_rows(table):
+    """
+    Converts a columnar assignment table to the list of
+    AssignmentLine.list tuples returned by main.
+    """
+    rows = []
+    for line in table:
+        ss_prob = [None if np.isnan(x) else x for x in line['ss']]
+        rows.append(tuple([str(line['res'])] + list(line['atoms']) +
+                          list(line['scores']) + [line['joint']] +
+                          ss_prob))
+    return rows
+
+
+def _ranked_groups(assignment_sets, weights=None, min_joint=None):
+    """
+    Best-first enumeration of the residue assignment table. Yields
+    normalized and sorted tables, one for each group of rows with the
+    same joint probability. The normalization totals are computed
+    from the per-residue sums, so only the rows that are yielded are
+    ever built.
+    """
+    n = len(assignment_sets)
+    choices = _residue_choices(assignment_sets)
+    if weights is None:
+        weights = collections.defaultdict(lambda: 1.0)
+
+    totals = _normalization_totals(choices, weights)
+
+    def weighted_joint(res, ind):
+        scores = [_score(choices[res][k][x]) for k, x in enumerate(ind)]
+        return weights[res] * np.prod(scores)
+
+    heap = []
+    for res in sorted(choices):
+        ind = (0, ) * n
+        heapq.heappush(heap, (-weighted_joint(res, ind), res, ind, 0))
+
+    group = []
+    group_joint = None
+    while heap:
+        joint, res, ind, last = heapq.heappop(heap)
+        joint = -joint
+        norm_joint = _normalize(joint, totals[-1])
+
+        # Every row with the same joint probability has to be in hand
+        # before they can be ordered by the individual probabilities.
+        if group and norm_joint != group_joint:
+            yield _build_table(choices, group, weights, totals)
+            group = []
+
+        if min_joint is not None and norm_joint <= min_joint:
+            return
+
+        # Only increment the indices at or after the last incremented
+        # one, so every combination is pushed exactly once.
+        for k in range(last, n):
+            if ind[k] + 1 < len(choices[res][k]):
+                next_ind = ind[:k] + (ind[k] + 1, ) + ind[k+1:]
+                heapq.heappush(heap, (-weighted_joint(res, next_ind), res,
+                                      next_ind, k))
+
+        group.append((res, ind, joint))
+        group_joint = norm_joint
+
+    if group:
+        yield _build_table(choices, group, weights, totals)
+
+
+def _build_table(choices, group, weights, totals):
+    """
+    Fills, normalizes and sorts the table for a list of (res, indices,
+    weighted joint score).
+    """
+    n = len(totals) - 1
+    table = np.zeros(len(group), dtype=table_dtype(n))
+    ss_scores = np.empty((len(group), n, 3)) * np.nan
+    weight = np.zeros(len(group))
+
+    for i, (res, ind, joint) in enumerate(group):
+        table['res'][i] = res
+        table['joint'][i] = joint
+        weight[i] = weights[res]
+        for k, x in enumerate(ind):
+            assign = choices[res][k][x]
+            table['atoms'][i, k] = assign.atoms if assign else None
+            table['scores'][i, k] = _score(assign)
+            if assign and assign.ss_scores:
+                ss_scores[i, k] = assign.ss_scores
+
+    # Normalize the columns in place.
+    table['scores'] = _normalize(table['scores'] * weight[:, None],
+                                 totals[:-1])
+    table['joint'] = _normalize(table['joint'], totals[-1])
+    table['ss'] = _ss_prob(ss_scores)
+
+    order = np.lexsort((table['scores'].sum(axis=1), table['joint']))
+    table[:] = table[order[::-1]]
+    return table
+
+
+def _ss_prob(ss_scores):
+    """
+    Vectorized AssignmentLine.ss_prob, the product of the known
+    secondary-structure scores over the peaks of each row converted
+    to probabilities (%), nan if unknown.
+    """
+    known = ~np.isnan(ss_scores).any(axis=2)[..., None]
+    prod = np.prod(np.where(known, ss_scores, 1.0), axis=1)
+    nonzero = (np.where(known, ss_scores, 0.0) != 0).any(axis=(1, 2))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        prob = prod / prod.sum(axis=1)[:, None]
+    prob = np.round(prob * 100, 1)
+    prob[~nonzero] = np.nan
+    return prob
+
+
+def _residue_choices(assignment_sets):
+    """
+    For each residue, each peak's assignments sorted by descending
+    score. [None] is a placeholder for peaks the residue can not
+    explain.
+    """
+    res_types = set([y for x in assignment_sets for y in x])
+
+    choices = dict()
+    for res in res_types:
+        choices[res] = []
+        for assignment_set in assignment_sets:
+            assign = sorted(assignment_set.get(res, []), key=_score,
+                            reverse=True)
+            choices[res].append(assign if assign else [None])
+    return choices
+
+
+def _normalization_totals(choices, weights):
+    """
+    Sum of the weighted scores over every row of the table for each
+    peak and for the joint score, without building the rows.
+    """
+    n = len(next(iter(choices.values()))) if choices else 0
+    totals = np.zeros(n + 1)
+    for res, res_choices in choices.items():
+        sums = np.array([sum(map(_score, x)) for x in res_choices])
+        counts = np.array([len(x) for x in res_choices])
+        for k in range(n):
+            others = np.prod(np.delete(counts, k))
+            totals[k] += weights[res] * sums[k] * others
+        totals[-1] += weights[res] * np.prod(sums)
+    return totals
+
+
+def _score(assign):
+    """Score of an Assignment, 0 for a placeholder."""
+    return assign.scores if assign else 0
+
+
+def _normalize(value, total):
+    """Percent of the total rounded to 0.1, 0 if the total is 0."""
+    total = np.asarray(total, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percent = np.where(total != 0, value / total * 100, 0.0)
+    return np.round(percent, 1)
+
+
+def assign_spectrum(peaks, experiment_name='c', seq=None, level=95,
+                    frequency=True, mode='spline', sigma=None):
+    """
+    Assigns every peak of a spectrum at once. Each peak is scored
+    against every correlation allowed by the sequence, the scores are
+    zeroed outside of the chemical shift ranges at the given level,
+    weighted by the residue frequencies and normalized per peak.
+
+    :param peaks: (n_peaks, dims) array like of chemical shifts, one
+        row for every peak in the spectrum
+    :param experiment_name: one of the keys from
+        inbase.standard_experiments
+    :param seq: protein sequence 1-letter amino-acid codes or None
+        for the 20 standard amino-acids
+    :param level: int, one of the defined levels normally in
+        {68, 85, 95}
+    :param frequency: If true the residue frequencies of the sequence
+        are used as priors, see base.ProteinSeq.aa_fractions
+    :param mode: 'spline' or 'linear' PDF interpolation, see
+        inbase.Continuous.score
+    :param sigma: float, Gaussian peak uncertainty in ppm or None, see
+        inbase.Continuous.score
+    :return: (correlations, posteriors), the list of
+        pluq.base.Correlation and an np.array with shape (n_peaks,
+        n_correlations). Rows sum to 1, or 0 for peaks outside of
+        every range.
+    """
     try:
-        ind = levels.index(level)
-    except ValueError:
-        mesg = 'Chose a confidence level from {}'.format(levels)
+        exp = inbase.standard_experiments[experiment_name]
+    except KeyError:
+        mesg = '{} is not a known experiment'.format(experiment_name)
         raise ValueError(mesg)
 
-    # Find all the hits
-    exp = inbase.standard_experiments[experiment_name]
-    if exp.dims == 1:
-        new_correlations = []
-        for corr in correlations:
-            try:
-                cs_range = pdf_dict[str(corr)+',levs'][ind]
-            except KeyError:
-                continue
+    peaks = _peak_array(peaks)
+    if exp.dims != peaks.shape[1]:
+        mesg = 'The peak dims in not equal to the experiment!'
+        raise ValueError(mesg)
+
+    protein = base.ProteinSeq(seq)
+    correlations = protein.relevant_correlations(
+        exp, structure=False, ignoresymmetry=True, offdiagonal=False)
 
-            if min(cs_range) <= resonance <= max(cs_range):
-                new_correlations.append(corr)
-        correlations = new_correlations
+    _check_levels(experiment_name, [level])
 
-    else:
-        region_dict = fileio.read_region(experiment_name, level)
-        regions = [region_dict[str(x)] for x in correlations]
+    # Which ranges hold each peak.
+    hits = _range_lookup(experiment_name, level).query_many(
+        _index_points(peaks))
 
-        # Find all the hits
-        hits = map(Point(resonance).within, regions)
-        correlations = list(compress(correlations, hits))
+    columns = {str(x): n for n, x in enumerate(correlations)}
+    inside = np.zeros((len(peaks), len(correlations)), dtype=bool)
+    for k, peak_hits in enumerate(hits):
+        ind = [columns[x] for x in peak_hits if x in columns]
+        inside[k, ind] = True
 
-    # Score all the hits
-    assignments = collections.defaultdict(list)
-    for corr in correlations:
+    # Likelihoods, priors and posteriors.
+    likelihood = score_matrix(peaks, correlations, experiment_name, mode,
+                              sigma)
+    likelihood = np.where(inside, np.nan_to_num(likelihood), 0.0)
 
-        try:
-            smooth = inbase.get_pdf(corr, pdf_dict)
-            corr_score = float(smooth.score(resonance))
-        except ValueError:
-                corr_score = 0
-        except KeyError:
-                corr_score = 0
-
-        ss_scores = []
-        for ss in ['H', 'C', 'E']:
-            try:
-                ss_corr = Correlation(corr.aa, corr.atoms, ss)
-                corr_ss_smooth = inbase.get_pdf(ss_corr, pdf_dict)
-                ss_scores.append(float(corr_ss_smooth.score(resonance)))
-            except ValueError:
-                ss_scores.append(0)
-            except KeyError:
-                ss_scores = None
-                break
-
-        assign = Assignment(corr.aa, corr.atoms, corr_score,
-                            ss_scores)
-        assignments[corr.aa].append(assign)
-    return assignments
+    if frequency:
+        fractions = protein.aa_fractions
+        prior = np.array([fractions[x.aa] for x in correlations])
+    else:
+        prior = np.ones(len(correlations))
+
+    posteriors = likelihood * prior
+    totals = posteriors.sum(axis=1)[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        posteriors = np.where(totals > 0, posteriors / totals, 0.0)
+
+    return correlations, posteriors
 
 
 def main(resonance_set, experiment_name='c', seq=None, level=95,
-         frequency=True):
+         frequency=True, mode='spline', sigma=None, top_n=None,
+         min_joint=None):
     """
     PLUQin: returns a table of possible intra-residue assignments
     and there likelihoods based on input chemical shifts and
@@ -185,8 +665,54 @@ def main(resonance_set, experiment_name='c', seq=None, level=95,
     :param frequency: If true accounts for the frequency of amino
         acids in the sequence. If no sequence it used the average
         amino acid frequencies.
+    :param mode: 'spline' or 'linear' PDF interpolation, see
+        inbase.Continuous.score
+    :param sigma: float, Gaussian peak uncertainty in ppm or None, see
+        inbase.Continuous.score
+    :param top_n: int, only return the best top_n assignments
+    :param min_joint: float, only return assignments with a joint
+        probability (%) above min_joint
     :returns: list of AssignmentLine.list
     """
+    prepared = _prepare(resonance_set, experiment_name, seq, level,
+                        frequency, mode, sigma)
+    if prepared is None:
+        return None
+
+    # Compare scores with one another to get probabilities
+    assignment_sets, weights = prepared
+    table = assignment_table(assignment_sets, weights, top_n, min_joint)
+    return table_rows(table)
+
+
+def iter_main(resonance_set, experiment_name='c', seq=None, level=95,
+              frequency=True, mode='spline', sigma=None, top_n=None,
+              min_joint=None):
+    """
+    Streaming version of main, it takes the same arguments. The rows
+    are yielded in the same order as soon as they are final, only the
+    rows with the current joint probability are held in memory. The
+    input is checked and the peaks are scored before this returns.
+
+    :returns: iterator of AssignmentLine.list tuples, empty if no
+        chemical shifts were found
+    """
+    prepared = _prepare(resonance_set, experiment_name, seq, level,
+                        frequency, mode, sigma)
+    if prepared is None:
+        return iter([])
+
+    assignment_sets, weights = prepared
+    return iter_assignments(assignment_sets, weights, top_n, min_joint)
+
+
+def _prepare(resonance_set, experiment_name, seq, level, frequency, mode,
+             sigma):
+    """
+    Checks the input of main and finds and scores the assignments.
+
+    :return: (assignment_sets, weights) or None if nothing was found
+    """
     try:
         exp = inbase.standard_experiments[experiment_name]
     except KeyError:
@@ -194,10 +720,11 @@ def main(resonance_set, experiment_name='c', seq=None, level=95,
         raise ValueError(mesg)
 
     # A little input validation.
-    if isinstance(resonance_set[0], collections.Iterable):
-        peak_dims = len(resonance_set[0])
-    else:
-        peak_dims = 1
+    try:
+        peak_dims = _peak_array(resonance_set).shape[1]
+    except ValueError:
+        mesg = 'Every peak should have the same number of shifts!'
+        raise ValueError(mesg)
 
     if exp.dims != peak_dims:
         mesg = 'The peak dims in not equal to the experiment!'
@@ -208,88 +735,44 @@ def main(resonance_set, experiment_name='c', seq=None, level=95,
     correlations = protein.relevant_correlations(
         exp, structure=False, ignoresymmetry=True, offdiagonal=False)
 
-    # Assign and score each resonance in cs_set.
-    n = len(resonance_set)
-    assignment_sets = []
-    for cs in resonance_set:
-        resonance_choices = get_resonance_choices(
-            cs, correlations, experiment_name, level)
-        assignment_sets.append(resonance_choices)
-
-    # Get a list of all possible residue assignments
-    res_types = set([y for x in assignment_sets for y in x])
-
-    # Combine the info into a table like structure
-    assignment_lines = []
-    for res in res_types:
-        res_assignments = [x[res] for x in assignment_sets]
-
-        # Regroup and fill in placeholder  nulls
-        rows = []
-        # TODO: should append None, but it breaks collections.product
-        for assign in res_assignments:
-            if not assign:
-                rows.append('-')
-            else:
-                rows.append(assign)
-
-        # Separate different atoms type assignments
-        sub_assignments = list(product(*rows))
-        for sub_assignment in sub_assignments:
-            atoms = []
-            scores = []
-            ss_scores = []
-            for atom_sub_assignment in sub_assignment:
-                try:
-                    atoms.append(atom_sub_assignment.atoms)
-                except AttributeError:
-                    atoms.append(None)
-
-                try:
-                    scores.append(atom_sub_assignment.scores)
-                except AttributeError:
-                    scores.append(0)
-
-                try:
-                    if atom_sub_assignment.ss_scores:
-                        ss_scores.append(atom_sub_assignment.ss_scores)
-                    else:
-                        ss_scores.append(np.empty(3)*np.nan)
-                except AttributeError:
-                    ss_scores.append(np.empty(3)*np.nan)
-
-            line = AssignmentLine(res, atoms, scores, ss_scores)
-            assignment_lines.append(line)
+    # Assign and score all the resonances in cs_set.
+    assignment_sets = get_resonance_set_choices(
+        resonance_set, correlations, experiment_name, level, mode, sigma)
 
-    # Compare scores with one another to get probabilities
-    rows = [x.list for x in assignment_lines]
-    columns = list(zip(*rows))
-
-    if not columns:
+    if not any(assignment_sets):
         return None
 
-    for k in list(range(n+1, n*2+1+1)):
-        scores = np.array(columns[k])
+    weights = protein.aa_fractions if frequency else None
+    return assignment_sets, weights
 
-        # get the amino acid fractions
-        if frequency:
-            aa_scale = np.array([protein.aa_fractions[x] for x in
-                                 columns[0]])
-            aa_scale = aa_scale / aa_scale.sum()
-            scores = scores * aa_scale
 
-        summed = scores.sum()
-        if not summed:
-            scores = [0, ] * len(scores)
-        else:
-            scores = scores/summed
-            scores = np.round(scores * 100, 1)
-        columns[k] = scores
+def assign_groups(resonance_sets, experiment_name='c', processes=None,
+                  **kwargs):
+    """
+    Runs main for many independent peak groups. The groups are shared
+    out to a pool of worker processes and the tables are yielded in
+    input order.
+
+    :param resonance_sets: iterable of resonance_set, see main
+    :param experiment_name: one of the keys from
+        inbase.standard_experiments
+    :param processes: int, number of worker processes, None for one
+        per CPU or 1 to run in this process
+    :param kwargs: other options for main
+    :returns: generator of main's return value, one per group
+    """
+    run = partial(main, experiment_name=experiment_name, **kwargs)
 
-    # Sort the assignment by the joint and then sum of probabilities
-    order_scores = [columns[-4],
-                    list(np.sum(np.array(columns[n+1:n*2+1]), axis=0))]
-    ind = np.lexsort((order_scores[1], order_scores[0]))[::-1]
-    rows = [list(zip(*columns))[x] for x in ind]
+    if processes == 1:
+        for resonance_set in resonance_sets:
+            yield run(resonance_set)
+        return
 
-    return rows
+    pool = multiprocessing.Pool(processes)
+    try:
+        for table in pool.imap(run, resonance_sets):
+            yield table
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
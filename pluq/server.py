@@ -0,0 +1,213 @@
+"""
+Long-running PLUQin query server. The PDF files, range indexes and
+region indexes are loaded once and shared by every request, so only
+the first query pays for reading the data files.
+
+Requests are JSON over HTTP on localhost:
+
+- POST /assign with {"peaks": [...], "experiment": "c", "seq": "",
+  "level": 95, "mode": "spline", "sigma": null, "top_n": null,
+  "min_joint": null},
+  only "peaks" is required. Returns {"table": [row, ...]} with the
+  rows of pluq.pluqin.main, or {"table": null} if nothing was found.
+- GET /health returns the uptime, request counts and cache statistics.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import json
+import os
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import numpy as np
+
+import pluq.cache as cache
+import pluq.fileio as fileio
+import pluq.inbase as inbase
+from pluq.base import ProteinSeq
+from pluq.pluqin import main
+
+
+# Options of pluqin.main that can be set in a request.
+query_options = ('experiment', 'seq', 'level', 'mode', 'sigma', 'top_n',
+                 'min_joint')
+
+
+def warm(experiments=None, decode=True):
+    """
+    Loads the data needed to answer queries into the shared cache.
+
+    :param experiments: list of experiment names, default is every
+        experiment with a PDF file in the package
+    :param decode: bool, if True every PDF is decoded to a Continuous
+        and stacked the way pluqin.main reads them
+    :return: list of the experiments that were loaded
+    """
+    if experiments is None:
+        experiments = sorted(inbase.standard_experiments)
+
+    loaded = []
+    for exp_name in experiments:
+        try:
+            pdf_file = cache.query_cache.pdf_file(exp_name)
+        except (IOError, OSError):
+            continue
+
+        for level in pdf_file.attrs['confidence_levels']:
+            level = int(level)
+            if inbase.standard_experiments[exp_name].dims == 1:
+                cache.query_cache.interval_index(exp_name, level)
+            elif exp_name in fileio.shapefile_exptype:
+                cache.query_cache.region_lookup(exp_name, level)
+
+        if decode:
+            for key in pdf_file:
+                if not key.endswith((',x', ',levs', ',blur')):
+                    cache.query_cache.get_pdf(key, exp_name)
+
+            # The X/H/C/E stacks pluqin.main scores with.
+            correlations = ProteinSeq(None).relevant_correlations(
+                inbase.standard_experiments[exp_name], structure=False,
+                ignoresymmetry=True, offdiagonal=False)
+            for corr in correlations:
+                try:
+                    cache.query_cache.get_pdf_stack(corr, exp_name)
+                except KeyError:
+                    pass
+        loaded.append(exp_name)
+    return loaded
+
+
+def query(request):
+    """
+    Answers one request, the same as calling pluqin.main.
+
+    :param request: dict with "peaks" and optionally any of
+        query_options
+    :return: list of rows or None
+    :raises ValueError: for a bad request
+    """
+    try:
+        peaks = request['peaks']
+    except (KeyError, TypeError):
+        raise ValueError('The request needs "peaks".')
+
+    unknown = set(request) - set(query_options) - {'peaks'}
+    if unknown:
+        mesg = 'Unknown options: {}'.format(', '.join(sorted(unknown)))
+        raise ValueError(mesg)
+
+    sigma = request.get('sigma')
+    if sigma is not None and (
+            isinstance(sigma, bool) or not isinstance(sigma, (int, float)) or
+            not 0 <= sigma <= inbase.max_blur_sigma):
+        mesg = '"sigma" should be a number from 0 to {} ppm.'.format(
+            inbase.max_blur_sigma)
+        raise ValueError(mesg)
+
+    kwargs = {x: request[x] for x in query_options if x in request}
+    kwargs['experiment_name'] = kwargs.pop('experiment', 'c')
+    return main(peaks, **kwargs)
+
+
+def _jsonable(value):
+    """NumPy scalars and tuples in table rows to JSON types."""
+    if isinstance(value, (tuple, list)):
+        return [_jsonable(x) for x in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class QueryServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server, each request is answered in its own thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, handler):
+        HTTPServer.__init__(self, address, handler)
+        self.started = time.time()
+        self.counts = {'requests': 0, 'errors': 0}
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def statistics(self):
+        """Uptime, request counts and cache statistics."""
+        with self.lock:
+            counts = dict(self.counts)
+        info = cache.query_cache.info()
+        return {'status': 'ok',
+                'pid': os.getpid(),
+                'uptime': time.time() - self.started,
+                'counts': counts,
+                'cache': {x: info[x]._asdict() for x in info}}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """JSON request handler for QueryServer."""
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/health', '/stats'):
+            self._send(200, self.server.statistics())
+        else:
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/assign':
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+
+        self.server.count('requests')
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            table = query(request)
+        except (ValueError, TypeError, KeyError, IOError, OSError) as err:
+            self.server.count('errors')
+            self._send(400, {'error': str(err)})
+            return
+        except Exception as err:
+            self.server.count('errors')
+            self._send(500, {'error': '{}: {}'.format(type(err).__name__,
+                                                      err)})
+            return
+
+        self._send(200, {'table': _jsonable(table)})
+
+    def _send(self, status, body):
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Requests are not logged to stderr."""
+        pass
+
+
+def make_server(host='127.0.0.1', port=8765, experiments=None):
+    """
+    Warms the cache and binds a QueryServer, call serve_forever() on
+    the result to start answering requests.
+
+    :param host: str, only bind to localhost unless you need to
+    :param port: int, 0 picks a free port
+    :param experiments: list of experiments to load up front
+    :rtype: QueryServer
+    """
+    warm(experiments)
+    return QueryServer((host, port), QueryHandler)
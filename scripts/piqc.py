@@ -93,8 +93,8 @@ def calc_cs_stats(pacsy_database, verbose=True):
                 num = int((max_cs - min_cs) / 0.01)
             x_grid = np.linspace(min_cs, max_cs, num)
 
-            smooth = estimate_pdf(data, grid=x_grid, bandwidth='cv',
-                                  params=params, cv=10)
+            smooth = estimate_pdf(data, grid=x_grid, bandwidth='loo',
+                                  params=params, method='binned')
 
         except ValueError:
             no_good.append(corr)
@@ -103,9 +103,9 @@ def calc_cs_stats(pacsy_database, verbose=True):
         cs_stats[corr]['mode'] = smooth.mode
         cs_stats[corr]['avg'] = np.mean(data)
         cs_stats[corr]['std'] = np.std(data)
-        levels = smooth.levels(data, 95)
-        cs_stats[corr]['min95'] = np.min(levels)
-        cs_stats[corr]['max95'] = np.min(levels)
+        (low, high) = next(smooth.get_levels(None, 95))
+        cs_stats[corr]['min95'] = low
+        cs_stats[corr]['max95'] = high
 
         if verbose:
             progress = 'Finished {}, \
@@ -188,8 +188,8 @@ def calc_seq_cs(pacsy_db, cs_stats, key_ids, verbose=True):
                 x_grid = np.linspace(mincs, maxcs, num)
 
                 smooth = estimate_pdf(deltas,  grid=x_grid,
-                                      bandwidth='cv',
-                                      params=params, cv=10)
+                                      bandwidth='loo',
+                                      params=params, method='binned')
             except ValueError:
                 protein_no_data.append((key_id, element))
                 continue
@@ -70,9 +70,96 @@ from __future__ import print_function
 
 __version__ = '0.2.1.0'
 
+
+def print_table(cs_set, exp_name, table):
+    """
+    Pretty prints a table returned by pluq.pluqin.main. The cut-off
+    and row limit are applied by main, every row is printed.
+    """
+    print('input: {}'.format(', '.join(map(str, cs_set))))
+    print('experiment: {}'.format(exp_name))
+
+    if table is None:
+        print('No chemical shifts were found!')
+
+    elif not table:
+        print('No assignments are above the cut off!')
+
+    else:
+        n = len(cs_set)
+        header = ['AA'] + ['p{}'.format(x+1) for x in range(n)]*2
+        header += ['Joint', 'H', 'C', 'E']
+        cols = [list(x) for x in zip(*table)]
+        col_widths = [max(map(len, map(str, x))) for x in cols]
+        fmt = '  '.join(['{{:<{}}}'.format(width) for width in
+                         col_widths])
+
+        print(fmt.format(*header))
+        for line in table:
+            line = map(str, [x if x else '-' for x in line])
+            print(fmt.format(*line))
+
+
+output_formats = ('table', 'ndjson', 'csv')
+
+
+def row_record(row, n, label=None):
+    """
+    Dictionary of one row of a table returned by pluq.pluqin.main for n
+    peaks, unassigned peaks have None atoms.
+    """
+    record = {'res': row[0],
+              'atoms': [list(x) if x else None for x in row[1:n+1]],
+              'probs': [float(x) for x in row[n+1:2*n+1]],
+              'joint': float(row[2*n+1]),
+              'ss': [None if x is None else float(x) for x in row[-3:]]}
+    if label is not None:
+        record['group'] = label
+    return record
+
+
+def write_ndjson(rows, n, fid, label=None):
+    """
+    Writes rows as they arrive, one JSON object per line.
+    """
+    import json
+
+    for row in rows:
+        fid.write(json.dumps(row_record(row, n, label)) + '\n')
+        fid.flush()
+
+
+def csv_header(n, label=False):
+    header = ['group'] if label else []
+    header += ['AA'] + ['atoms{}'.format(x+1) for x in range(n)]
+    header += ['p{}'.format(x+1) for x in range(n)]
+    return header + ['Joint', 'H', 'C', 'E']
+
+
+def write_csv(rows, n, writer, fid, label=None, width=None):
+    """
+    Writes rows as they arrive with a csv.writer, atoms are joined
+    with '-' and missing values are empty. Rows are padded to width
+    peaks, so groups of different sizes share the csv_header columns.
+    """
+    pad = [''] * ((width or n) - n)
+    for row in rows:
+        record = row_record(row, n)
+        line = [] if label is None else [label]
+        line += [record['res']]
+        line += ['-'.join(x) if x else '' for x in record['atoms']] + pad
+        line += record['probs'] + pad + [record['joint']]
+        line += ['' if x is None else x for x in record['ss']]
+        writer.writerow(line)
+        fid.flush()
+
+
 if __name__ == "__main__":
     import argparse
-    from pluq.pluqin import main
+    import sys
+    from pluq.fileio import peak_list_formats, read_peak_list
+    from pluq.inbase import standard_experiments, max_blur_sigma
+    from pluq.pluqin import main, iter_main, assign_groups
 
     # Set up command line options.
     parser = argparse.ArgumentParser(
@@ -107,6 +194,36 @@ if __name__ == "__main__":
         help="""Cut off %% value, input a negative number for
         everything.""")
 
+    parser.add_argument(
+        "-n", "--top_n",
+        action="store",
+        type=int,
+        default=None,
+        help="""Only show the best top_n assignments, default is
+        all of them.""")
+
+    parser.add_argument(
+        "-m", "--mode",
+        default='spline',
+        choices=['spline', 'linear'],
+        help="""PDF interpolation, 'linear' is faster and very close
+        to 'spline'.""")
+
+    parser.add_argument(
+        "--sigma",
+        type=float,
+        default=None,
+        help="""Peak position uncertainty in ppm, the PDFs are blurred
+        with a Gaussian of this standard deviation. At most
+        {} ppm.""".format(max_blur_sigma))
+
+    parser.add_argument(
+        "-o", "--output",
+        default='table',
+        choices=output_formats,
+        help="""Output format: an aligned table, or ndjson/csv rows
+        written as soon as they are ranked.""")
+
     parser.add_argument(
         "-s", "--seq",
         action="store",
@@ -114,39 +231,142 @@ if __name__ == "__main__":
         default='',
         help="Protein sequence in 1-letter amino-acid code.")
 
+    parser.add_argument(
+        "-f", "--peak_file",
+        help="""Peak list with one or more peak groups, use - to read
+        from stdin. Each group is assigned on its own.""")
+
+    parser.add_argument(
+        "--format",
+        default='csv',
+        choices=peak_list_formats,
+        help="""Peak list format: csv (blank lines separate groups),
+        sparky or nmrpipe (every peak is a group).""")
+
+    parser.add_argument(
+        "--axes",
+        type=int,
+        nargs='+',
+        default=None,
+        help="""Shift columns of the peak list to use, in the nuclei
+        order of the experiment and counted from 1. For example
+        --axes 2 1 reads a Sparky list with w1 = N and w2 = C for cn.
+        Default the first columns in order.""")
+
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="""Worker processes for a peak list, default is one per
+        CPU.""")
+
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="""Run a local server that keeps the data loaded and
+        answers JSON queries, see pluq.server.""")
+
+    parser.add_argument(
+        "--host",
+        default='127.0.0.1',
+        help="Server address, default 127.0.0.1.")
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Server port, default 8765.")
+
     # Parse the options.
     parser_dict = vars(parser.parse_args())
 
-    if parser_dict['peak'] is None:
-        parser.error('Use pluqin.py -h to see options.')
+    sigma = parser_dict['sigma']
+    if sigma is not None and not 0 <= sigma <= max_blur_sigma:
+        parser.error('--sigma should be from 0 to {} ppm.'.format(
+            max_blur_sigma))
+
+    if parser_dict['serve']:
+        from pluq.server import make_server
+
+        server = make_server(parser_dict['host'], parser_dict['port'])
+        print('PLUQin server on http://{}:{}'.format(
+            *server.server_address[:2]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+        sys.exit(0)
 
-    cs_set = parser_dict['peak']
     exp_name = parser_dict['exp_name']
     cut_off = parser_dict['cut_off']
+    top_n = parser_dict['top_n']
     seq = parser_dict['seq']
+    mode = parser_dict['mode']
+    output = parser_dict['output']
+    if output == 'csv':
+        import csv
+        writer = csv.writer(sys.stdout, lineterminator='\n')
 
-    table = main(cs_set, exp_name, seq=seq)
+    if parser_dict['peak_file']:
+        file_name = parser_dict['peak_file']
+        dims = standard_experiments[exp_name].dims
+        axes = parser_dict['axes']
+        if axes is not None:
+            if min(axes) < 1:
+                parser.error('--axes are counted from 1.')
+            axes = [x - 1 for x in axes]
 
-    # Pretty Printing
-    print('input: {}'.format(', '.join(map(str, cs_set))))
-    print('experiment: {}'.format(exp_name))
+        try:
+            if file_name == '-':
+                groups = read_peak_list(sys.stdin, parser_dict['format'],
+                                        dims, axes)
+            else:
+                with open(file_name, 'r') as fid:
+                    groups = read_peak_list(fid, parser_dict['format'],
+                                            dims, axes)
+        except (ValueError, IOError, OSError) as err:
+            parser.error('Could not read {}: {}'.format(file_name, err))
 
-    if table is None:
-        print('No chemical shifts were found!')
+        labels = [x[0] for x in groups]
+        cs_sets = [x[1] for x in groups]
+        tables = assign_groups(cs_sets, exp_name, parser_dict['jobs'],
+                               seq=seq, mode=mode,
+                               sigma=parser_dict['sigma'], top_n=top_n,
+                               min_joint=cut_off)
 
-    else:
-        n = len(cs_set)
-        header = ['AA'] + ['p{}'.format(x+1) for x in range(n)]*2
-        header += ['Joint', 'H', 'C', 'E']
-        cols = [list(x) for x in zip(*table)]
-        col_widths = [max(map(len, map(str, x))) for x in cols]
-        fmt = '  '.join(['{{:<{}}}'.format(width) for width in
-                         col_widths])
+        width = max([len(x) for x in cs_sets] + [0])
+        if output == 'csv':
+            writer.writerow(csv_header(width, label=True))
 
-        print(fmt.format(*header))
-        for line in table:
+        for label, cs_set, table in zip(labels, cs_sets, tables):
+            if output == 'ndjson':
+                write_ndjson(table or [], len(cs_set), sys.stdout, label)
+            elif output == 'csv':
+                write_csv(table or [], len(cs_set), writer, sys.stdout,
+                          label, width)
+            else:
+                print('group: {}'.format(label))
+                print_table(cs_set, exp_name, table)
+                print('')
+        sys.exit(0)
 
-            if line[-4] <= cut_off:
-                break
-            line = map(str, [x if x else '-' for x in line])
-            print(fmt.format(*line))
+    if parser_dict['peak'] is None:
+        parser.error('Use pluqin.py -h to see options.')
+
+    cs_set = parser_dict['peak']
+
+    options = dict(seq=seq, mode=mode, sigma=parser_dict['sigma'],
+                   top_n=top_n, min_joint=cut_off)
+
+    if output == 'ndjson':
+        write_ndjson(iter_main(cs_set, exp_name, **options), len(cs_set),
+                     sys.stdout)
+    elif output == 'csv':
+        writer.writerow(csv_header(len(cs_set)))
+        write_csv(iter_main(cs_set, exp_name, **options), len(cs_set),
+                  writer, sys.stdout)
+    else:
+        table = main(cs_set, exp_name, **options)
+
+        # Pretty Printing
+        print_table(cs_set, exp_name, table)
@@ -0,0 +1,26 @@
+"""
+Rasterizes the shipped cc and cn regions for fast membership lookups,
+run again whenever the region shape-files change.
+"""
+from __future__ import print_function
+import argparse
+import time
+
+from pluq.inbase import make_region_raster
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('exp_names', nargs='*', default=['cc', 'cn'])
+parser.add_argument('--step', type=float, default=0.05,
+                    help='Cell size in ppm, default 0.05.')
+args = parser.parse_args()
+
+for exp_name in args.exp_names:
+    start = time.time()
+    rasters = make_region_raster(exp_name, step=args.step)
+    for level in sorted(rasters):
+        raster = rasters[level]
+        print('{} {}%: {} cells, {} bitsets, {:.1%} boundary'.format(
+            exp_name, level, raster.ids.size, len(raster.palette),
+            raster.boundary.mean()))
+    print('{} took {:.1f} s'.format(exp_name, time.time() - start))
@@ -0,0 +1,40 @@
+"""
+Micro-benchmark for the per-call cost of Continuous.score on a 1D PDF
+from the shipped c_pdf_all.h5 file and a 2D PDF on a 0.1 ppm grid.
+"""
+import timeit
+
+import numpy as np
+
+from pluq.fileio import read_pdf
+from pluq.inbase import Continuous, get_pdf
+
+
+def _fresh(smooth):
+    """Copy of smooth without a cached interpolator."""
+    return Continuous(smooth.pdf, smooth.grid)
+
+
+def _example_2d():
+    x = np.arange(40, 70, 0.1)
+    y = np.arange(10, 40, 0.1)
+    x_grid, y_grid = np.meshgrid(x, y)
+    pdf = np.exp(-((x_grid - 55)**2 + (y_grid - 20)**2) / 8.0)
+    return Continuous(pdf, (x_grid, y_grid))
+
+
+if __name__ == '__main__':
+    number = 1000
+
+    smooth_1d = get_pdf('Ala-(CA)-All', read_pdf('c'))
+    smooth_2d = _example_2d()
+
+    for name, smooth, point in [('1D', smooth_1d, 53.0),
+                                ('2D', smooth_2d, (55.0, 19.0))]:
+        uncached = timeit.timeit(
+            lambda: _fresh(smooth).score(point), number=number)
+        cached = timeit.timeit(lambda: smooth.score(point), number=number)
+
+        print('{}: {:.1f} us/call rebuilding the interpolator, '
+              '{:.1f} us/call cached'.format(name, 1e6 * uncached / number,
+                                             1e6 * cached / number))
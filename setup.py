@@ -26,6 +26,7 @@ setup(name='pluq',
       package_dir={'pluq': 'pluq'},
       package_data={'pluq': ['data/pdf/*',
                              'data/piqc_db/*',
+                             'data/regions/*.npz',
                              'data/regions/cc_region_all/*',
                              'data/regions/cn_region_all/*']},
       scripts=['scripts/pluqin.py', 'scripts/piqc.py'],
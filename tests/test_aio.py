@@ -0,0 +1,131 @@
+"""
+Unit tests for aio.py module.
+"""
+
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from pluq.aio import AsyncAssigner, assign_async, request_key
+from pluq.pluqin import main
+
+
+class AssignAsyncC(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+        unittest.TestCase.tearDown(self)
+
+    def block(self):
+        """Occupies every worker until the returned event is set."""
+        event = threading.Event()
+        for _ in range(2):
+            self.executor.submit(event.wait, 10)
+        return event
+
+    def test_matches_main(self):
+        table = asyncio.run(assign_async([55.0, 18.0], 'c', mode='linear'))
+        self.assertEqual(table, main([55.0, 18.0], 'c', mode='linear'))
+
+    def test_coalesced(self):
+        assigner = AsyncAssigner(self.executor)
+
+        async def run():
+            requests = [assigner.assign([55.0, 18.0], 'c'),
+                        assigner.assign([[55.0], [18.0]], 'c'),
+                        assigner.assign([55.0, 18.0], 'c', top_n=1)]
+            tasks = [asyncio.ensure_future(x) for x in requests]
+            await asyncio.sleep(0)
+            in_flight = assigner.in_flight()
+            return in_flight, await asyncio.gather(*tasks)
+
+        in_flight, tables = asyncio.run(run())
+        self.assertEqual(in_flight, 2)
+        self.assertIs(tables[0], tables[1])
+        self.assertEqual(len(tables[2]), 1)
+        self.assertEqual(assigner.in_flight(), 0)
+
+    def test_timeout(self):
+        assigner = AsyncAssigner(self.executor, timeout=0.05)
+        event = self.block()
+
+        async def run():
+            try:
+                await assigner.assign([55.0], 'c')
+            finally:
+                event.set()
+
+        self.assertRaises(asyncio.TimeoutError, asyncio.run, run())
+
+    def test_cancel_one_waiter(self):
+        """
+        Cancelling one caller should not cancel the shared call.
+        """
+        assigner = AsyncAssigner(self.executor)
+        event = self.block()
+
+        async def run():
+            first = asyncio.ensure_future(assigner.assign([55.0], 'c'))
+            second = asyncio.ensure_future(assigner.assign([55.0], 'c'))
+            await asyncio.sleep(0)
+            first.cancel()
+            await asyncio.sleep(0)
+            event.set()
+            return first, await second
+
+        first, table = asyncio.run(run())
+        self.assertTrue(first.cancelled())
+        self.assertEqual(table, main([55.0], 'c'))
+
+    def test_request_after_last_waiter_left(self):
+        """
+        A request arriving right after the only waiter was cancelled
+        should get its own call, not the cancelled one.
+        """
+        assigner = AsyncAssigner(self.executor)
+        event = self.block()
+
+        async def run():
+            first = asyncio.ensure_future(assigner.assign([55.0], 'c'))
+            await asyncio.sleep(0)
+            first.cancel()
+            # Runs right after first gives up, before the shared call is
+            # forgotten by its done callback.
+            second = asyncio.ensure_future(assigner.assign([55.0], 'c'))
+            await asyncio.sleep(0)
+            event.set()
+            try:
+                return first, second, await second
+            except asyncio.CancelledError:
+                return first, second, None
+
+        first, second, table = asyncio.run(run())
+        self.assertTrue(first.cancelled())
+        self.assertFalse(second.cancelled())
+        self.assertEqual(table, main([55.0], 'c'))
+
+    def test_errors_reach_every_waiter(self):
+        assigner = AsyncAssigner(self.executor)
+
+        async def run():
+            return await asyncio.gather(
+                assigner.assign([55.0], 'xx'), assigner.assign([55.0], 'xx'),
+                return_exceptions=True)
+
+        for result in asyncio.run(run()):
+            self.assertIsInstance(result, ValueError)
+
+    def test_request_key(self):
+        self.assertEqual(request_key([55.0, 18.0], 'c'),
+                         request_key([[55], [18]], 'c'))
+        self.assertNotEqual(request_key([55.0], 'c', top_n=1),
+                            request_key([55.0], 'c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Unit tests for base.py module.
+"""
+
+import unittest
+from pluq.base import ProteinSeq
+from pluq.inbase import standard_experiments
+
+
+class RelevantCorrelations(unittest.TestCase):
+
+    def test_counts(self):
+        for exp_name, n_all, n_simple in [('c', 284, 107), ('cc', 800, 281),
+                                          ('cn', 97, 34)]:
+            exp = standard_experiments[exp_name]
+            protein = ProteinSeq(None)
+            self.assertEqual(len(protein.relevant_correlations(exp)), n_all)
+            self.assertEqual(
+                len(protein.relevant_correlations(exp, structure=False)),
+                n_simple)
+
+    def test_union_of_residues(self):
+        """
+        A sequence's correlations are the union of its residues'.
+        """
+        exp = standard_experiments['cc']
+        joint = ProteinSeq('AGLA').relevant_correlations(exp)
+        parts = []
+        for res in 'AGL':
+            parts.extend(ProteinSeq(res).relevant_correlations(exp))
+        self.assertEqual(sorted(map(str, joint)), sorted(map(str, parts)))
+
+    def test_memoized(self):
+        exp = standard_experiments['c']
+        first = ProteinSeq('M').relevant_correlations(exp, structure=False)
+        second = ProteinSeq('M').relevant_correlations(exp, structure=False)
+        self.assertEqual(first, second)
+        for x, y in zip(first, second):
+            self.assertIs(x, y)
+
+        first.pop()
+        self.assertEqual(len(ProteinSeq('M').relevant_correlations(
+            exp, structure=False)), len(second))
+
+
+if __name__ == '__main__':
+    unittest.main()
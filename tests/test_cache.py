@@ -0,0 +1,59 @@
+"""
+Unit tests for cache.py module.
+"""
+
+import unittest
+from pluq.base import Correlation
+from pluq.cache import LRUCache, QueryCache
+
+
+class LRUCacheBehavior(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        lru = LRUCache(maxsize=2)
+        self.assertEqual(lru.get('a', lambda: 1), 1)
+        self.assertEqual(lru.get('a', lambda: 2), 1)
+        info = lru.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_least_recently_used_is_dropped(self):
+        lru = LRUCache(maxsize=2)
+        lru.get('a', lambda: 1)
+        lru.get('b', lambda: 2)
+        lru.get('a', lambda: 1)
+        lru.get('c', lambda: 3)
+        self.assertIn('a', lru)
+        self.assertNotIn('b', lru)
+        self.assertEqual(len(lru), 2)
+
+    def test_clear(self):
+        lru = LRUCache()
+        lru.get('a', lambda: 1)
+        lru.clear()
+        self.assertEqual(lru.info(), (0, 0, lru.maxsize, 0))
+
+
+class QueryCacheC(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = QueryCache()
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def test_same_pdf_returned(self):
+        corr = Correlation('A', ('CA', ), 'X')
+        first = self.cache.get_pdf(corr, 'c')
+        self.assertIs(first, self.cache.get_pdf(str(corr), 'c'))
+        self.assertIs(self.cache.pdf_file('c'), self.cache.pdf_file('c'))
+        self.assertEqual(self.cache.info()['pdfs'].hits, 1)
+
+    def test_missing_pdf(self):
+        corr = Correlation('W', ('CG', ), 'H')
+        for _ in range(2):
+            self.assertRaises(KeyError, self.cache.get_pdf, corr, 'c')
+        self.assertEqual(self.cache.info()['pdfs'].misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Unit tests for fileio.py module.
+"""
+
+import unittest
+from pluq.fileio import read_peak_list
+
+
+class ReadPeakList(unittest.TestCase):
+
+    def test_csv_groups(self):
+        lines = ['# CA and CB of one residue', '55.0', '18.0', '',
+                 '176.0, 55.2', '', 'G7 45.1', 'G7 173.2', 'L8 55.3']
+        groups = read_peak_list(lines, 'csv')
+        self.assertEqual(groups, [('group 1', [[55.0], [18.0]]),
+                                  ('group 2', [[176.0, 55.2]]),
+                                  ('G7', [[45.1], [173.2]]),
+                                  ('L8', [[55.3]])])
+
+    def test_csv_dims(self):
+        self.assertEqual(read_peak_list(['55.0', '18.0'], 'csv', dims=1),
+                         [('group 1', [[55.0], [18.0]])])
+        for line in ['18.0 30.0', 'A5 18.0 30.0', 'A5']:
+            with self.assertRaises(ValueError) as context:
+                read_peak_list(['55.0', line], 'csv', dims=1)
+            self.assertIn(line, str(context.exception))
+        self.assertRaises(ValueError, read_peak_list, ['55.0'], 'csv', dims=2)
+
+    def test_sparky(self):
+        lines = ['      Assignment         w1         w2   Data Height',
+                 '',
+                 '          A5CA-CB     53.012     19.004     1.2e+06',
+                 '              ?-?     62.100     70.050     8.0e+05']
+        groups = read_peak_list(lines, 'sparky', dims=2)
+        self.assertEqual(groups, [('A5CA-CB', [[53.012, 19.004]]),
+                                  ('?-?', [[62.1, 70.05]])])
+
+    def test_sparky_columns(self):
+        lines = ['      Assignment         w1         w2   Data Height',
+                 '',
+                 '           G7N-CA    109.100     45.200     1.2e+06',
+                 '           A5N-CA    123.400     53.000     8.0e+05']
+        self.assertEqual(read_peak_list(lines, 'sparky'),
+                         [('G7N-CA', [[109.1, 45.2]]),
+                          ('A5N-CA', [[123.4, 53.0]])])
+        self.assertEqual(read_peak_list(lines, 'sparky', 2, axes=[1, 0]),
+                         [('G7N-CA', [[45.2, 109.1]]),
+                          ('A5N-CA', [[53.0, 123.4]])])
+
+    def test_too_few_shifts(self):
+        sparky = ['      Assignment         w1   Data Height',
+                  '           A5CA     53.012     1.2e+06']
+        nmrpipe = ['VARS   INDEX X_PPM HEIGHT',
+                   '    1   55.100   +1.0e+06']
+        for lines, fmt in [(sparky, 'sparky'), (nmrpipe, 'nmrpipe')]:
+            with self.assertRaises(ValueError) as context:
+                read_peak_list(lines, fmt, dims=2)
+            self.assertIn(lines[1].strip(), str(context.exception))
+            self.assertRaises(ValueError, read_peak_list, lines, fmt,
+                              axes=[1])
+
+    def test_nmrpipe(self):
+        lines = ['DATA  X_AXIS 13C 1 512 200.000ppm 0.000ppm',
+                 'VARS   INDEX X_AXIS Y_AXIS X_PPM Y_PPM HEIGHT',
+                 'FORMAT %5d %9.3f %9.3f %8.3f %8.3f %+e',
+                 '',
+                 '    1   100.000   200.000   55.100   18.200 +1.0e+06',
+                 '    2   110.000   210.000   62.000   70.000 +2.0e+06']
+        groups = read_peak_list(lines, 'nmrpipe', dims=2)
+        self.assertEqual(groups, [('1', [[55.1, 18.2]]),
+                                  ('2', [[62.0, 70.0]])])
+
+    def test_bad_format(self):
+        self.assertRaises(ValueError, read_peak_list, [], 'xeasy')
+
+
+if __name__ == '__main__':
+    unittest.main()
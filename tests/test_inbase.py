@@ -0,0 +1,395 @@
+"""
+Unit tests for inbase.py module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from pluq.fileio import read_pdf
+from pluq.inbase import (Continuous, ContinuousStack, get_pdf, gaussian_blur,
+                         estimate_pdf, estimate_bandwidth)
+
+
+def gaussian_2d():
+    x = np.linspace(40, 70, 121)
+    y = np.linspace(10, 40, 151)
+    x_grid, y_grid = np.meshgrid(x, y)
+    pdf = np.exp(-((x_grid - 55)**2 + (y_grid - 20)**2 / 2.0) / 8.0)
+    return Continuous(pdf / pdf.sum(), (x_grid, y_grid))
+
+
+def gaussian_1d():
+    x = np.linspace(40, 70, 301)
+    pdf = np.exp(-(x - 55)**2 / 8.0)
+    return Continuous(pdf / pdf.sum(), x)
+
+
+class ContinuousInterpolator(unittest.TestCase):
+
+    def test_interpolator_reused(self):
+        for smooth in [gaussian_1d(), gaussian_2d()]:
+            self.assertIs(smooth.interpolator, smooth.interpolator)
+
+    def test_reassign_pdf(self):
+        smooth = gaussian_1d()
+        before = smooth.score(55.0)
+        smooth.pdf = smooth.pdf * 2
+        self.assertAlmostEqual(smooth.score(55.0), 2 * before)
+
+    def test_reassign_grid(self):
+        smooth = gaussian_1d()
+        before = smooth.score(55.0)
+        interpolator = smooth.interpolator
+        smooth.grid = smooth.grid + 1.0
+        self.assertIsNot(smooth.interpolator, interpolator)
+        self.assertAlmostEqual(smooth.score(56.0), before)
+
+    def test_reassign_resets_pyramid(self):
+        smooth = gaussian_1d()
+        before = smooth.score(55.0, sigma=0.25)
+        smooth.pdf = smooth.pdf * 2
+        self.assertAlmostEqual(smooth.score(55.0, sigma=0.25), 2 * before)
+
+        smooth.grid = smooth.grid + 5.0
+        self.assertAlmostEqual(smooth.score(60.0, sigma=0.25), 2 * before)
+        for level in smooth.pyramid.values():
+            np.testing.assert_array_equal(level.axes[0], smooth.axes[0])
+
+    def test_batch_matches_single(self):
+        smooth = gaussian_2d()
+        points = np.array([[55.0, 20.0], [50.2, 31.7], [66.0, 12.5]])
+        scores = smooth.score(points)
+        for point, score in zip(points, scores):
+            self.assertAlmostEqual(smooth.score(point), score)
+
+    def test_outside_1d_grid(self):
+        self.assertEqual(gaussian_1d().score(100.0), 0)
+
+
+class ContinuousLinearMode(unittest.TestCase):
+
+    def test_shipped_pdfs(self):
+        """
+        Linear scores should match the spline path on the shipped PDFs.
+        The shipped 'ch' file has no PDFs, so 2D is covered below.
+        """
+        rng = np.random.RandomState(0)
+        for exp in ['c', 'n', 'h', 'ch']:
+            pdf_file = read_pdf(exp)
+            for key in pdf_file:
+                if key.endswith((',x', ',levs')):
+                    continue
+                smooth = get_pdf(key, pdf_file)
+                limits = smooth.limits.reshape((-1, 2))
+                points = rng.uniform(limits[:, 0], limits[:, 1],
+                                     size=(50, smooth.dims))
+                if smooth.dims == 1:
+                    points = points[:, 0]
+
+                spline = smooth.score(points)
+                linear = smooth.score(points, mode='linear')
+                bound = 1e-9 * np.max(smooth.pdf) / np.prod(smooth.space)
+                self.assertTrue(np.all(np.abs(spline - linear) <= bound),
+                                msg=key)
+            pdf_file.close()
+
+    def test_2d(self):
+        smooth = gaussian_2d()
+        rng = np.random.RandomState(0)
+        points = np.column_stack([rng.uniform(40, 70, 500),
+                                  rng.uniform(10, 40, 500)])
+        spline = smooth.score(points)
+        linear = smooth.score(points, mode='linear')
+        peak = smooth.score((55.0, 20.0))
+        self.assertLess(np.max(np.abs(spline - linear)), 0.01 * peak)
+
+    def test_outside(self):
+        self.assertEqual(gaussian_2d().score((0.0, 0.0), mode='linear'), 0)
+
+    def test_bad_mode(self):
+        self.assertRaises(ValueError, gaussian_1d().score, 55.0, 'cubic')
+
+
+
+class ContinuousStackScore(unittest.TestCase):
+
+    def test_1d_matches_layers(self):
+        narrow = gaussian_1d()
+        wide = Continuous(narrow.pdf[::2], narrow.grid[::2] * 1.5 - 20)
+        stack = ContinuousStack([narrow, None, wide])
+        points = np.linspace(30, 90, 201)
+
+        scores = stack.score(points)
+        self.assertEqual(scores.shape, (3, len(points)))
+        self.assertTrue(np.isnan(scores[1]).all())
+        for layer, smooth in [(0, narrow), (2, wide)]:
+            np.testing.assert_allclose(scores[layer], smooth.score(points),
+                                       rtol=1e-12, atol=1e-15)
+
+    def test_2d_matches_layers(self):
+        smooth = gaussian_2d()
+        shifted = Continuous(smooth.pdf[:100, :80],
+                             (smooth.grid[0][:100, :80] + 2,
+                              smooth.grid[1][:100, :80] - 1))
+        stack = ContinuousStack([smooth, shifted])
+        points = np.array([[55.0, 20.0], [50.2, 31.7], [66.0, 12.5]])
+
+        for mode in ['spline', 'linear']:
+            scores = stack.score(points, mode)
+            for layer, layer_smooth in enumerate([smooth, shifted]):
+                np.testing.assert_allclose(
+                    scores[layer], layer_smooth.score(points, mode))
+
+    def test_layers_share_densities(self):
+        narrow = gaussian_1d()
+        pdf = narrow.pdf.copy()
+        stack = ContinuousStack([narrow, None, gaussian_1d()])
+        np.testing.assert_array_equal(narrow.pdf, pdf)
+        for layer in stack.smooths[::2]:
+            self.assertTrue(np.shares_memory(layer.pdf, stack._values))
+
+    def test_needs_a_pdf(self):
+        self.assertRaises(ValueError, ContinuousStack, [None, None])
+
+
+class BlurredPyramid(unittest.TestCase):
+
+    def test_blur_adds_variance(self):
+        smooth = gaussian_1d()
+        blurred = smooth.blur(0.5)
+        x = smooth.grid
+        self.assertAlmostEqual(blurred.pdf.sum(), 1.0)
+        self.assertAlmostEqual((blurred.pdf * (x - 55)**2).sum(), 4.25, 3)
+        self.assertIs(smooth.blur(0.5), blurred)
+
+    def test_blur_2d(self):
+        smooth = gaussian_2d()
+        blurred = smooth.blur(1.0)
+        x_grid, y_grid = smooth.grid
+        self.assertAlmostEqual((blurred.pdf * (x_grid - 55)**2).sum(), 5, 2)
+        self.assertAlmostEqual((blurred.pdf * (y_grid - 20)**2).sum(), 9, 1)
+
+    def test_score_sigma(self):
+        smooth = gaussian_1d()
+        self.assertEqual(smooth.score(55.0, sigma=0), smooth.score(55.0))
+        self.assertAlmostEqual(smooth.score(55.0, sigma=0.5),
+                               smooth.blur(0.5).score(55.0))
+
+        # Between levels the scores are interpolated in sigma.
+        smooth.blur(1.0)
+        self.assertAlmostEqual(
+            smooth.score(55.0, sigma=0.75),
+            (smooth.score(55.0, sigma=0.5) + smooth.score(55.0, sigma=1.0))/2)
+        self.assertEqual(sorted(smooth.pyramid), [0.1, 0.25, 0.5, 1.0])
+
+    def test_above_top_not_kept(self):
+        smooth = gaussian_1d()
+        for sigma in [0.7, 0.8, 1.1]:
+            self.assertAlmostEqual(smooth.score(55.0, sigma=sigma),
+                                   smooth._blurred(sigma).score(55.0))
+        self.assertEqual(sorted(smooth.pyramid), [0.1, 0.25, 0.5])
+
+        stack = ContinuousStack([smooth, None])
+        stack.score(55.0, sigma=1.5)
+        self.assertEqual(sorted(stack.pyramid), [0.1, 0.25, 0.5])
+        self.assertEqual(sorted(smooth.pyramid), [0.1, 0.25, 0.5])
+
+    def test_bad_sigma(self):
+        smooth = gaussian_1d()
+        stack = ContinuousStack([smooth, None])
+        for sigma in [-0.5, -5, 50.0]:
+            self.assertRaises(ValueError, smooth.score, 55.0, sigma=sigma)
+            self.assertRaises(ValueError, stack.score, 55.0, sigma=sigma)
+
+    def test_stack_sigma(self):
+        smooth = gaussian_1d()
+        stack = ContinuousStack([smooth, None])
+        points = np.array([50.0, 55.0, 57.5])
+        np.testing.assert_allclose(stack.score(points, sigma=0.25)[0],
+                                   smooth.score(points, sigma=0.25))
+
+    def test_read_pyramid(self):
+        smooth = gaussian_1d()
+        pyramid = [gaussian_blur(smooth.pdf, smooth.steps, x)
+                   for x in [0.1, 0.5]]
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with h5py.File(os.path.join(tmp_dir, 'pdf.h5'), 'w') as h5f:
+                h5f['Ala-(CA)-All'] = smooth.pdf
+                h5f['Ala-(CA)-All,x'] = smooth.grid_str
+                h5f['Ala-(CA)-All,levs'] = np.zeros((3, 2))
+                h5f['Ala-(CA)-All,blur'] = np.array(pyramid)
+                h5f['Ala-(CA)-All,blur'].attrs['sigmas'] = [0.1, 0.5]
+                read = get_pdf('Ala-(CA)-All', h5f)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(sorted(read.pyramid), [0.1, 0.5])
+        np.testing.assert_allclose(read.pyramid[0.5].pdf, pyramid[1])
+
+
+class CompactGrid(unittest.TestCase):
+
+    def test_axes(self):
+        smooth = gaussian_2d()
+        (x, y) = smooth.axes
+        self.assertEqual((x.shape, y.shape), ((121, ), (151, )))
+        x_grid, y_grid = smooth.grid
+        np.testing.assert_array_equal(x_grid, np.meshgrid(x, y)[0])
+        np.testing.assert_array_equal(y_grid, np.meshgrid(x, y)[1])
+        self.assertFalse(hasattr(smooth, '__dict__'))
+
+    def test_axes_or_meshgrid(self):
+        smooth = gaussian_2d()
+        other = Continuous(smooth.pdf, smooth.axes)
+        np.testing.assert_array_equal(other.limits, smooth.limits)
+        np.testing.assert_array_equal(other.grid_str, smooth.grid_str)
+        self.assertEqual(other.mode(), smooth.mode())
+        self.assertEqual(other.score((55.0, 20.0)),
+                         smooth.score((55.0, 20.0)))
+        self.assertEqual(smooth.mode(), [55.0, 20.0])
+
+    def test_pyramid_shares_axes(self):
+        smooth = gaussian_2d()
+        self.assertIs(smooth.blur(0.5).axes[0], smooth.axes[0])
+
+
+class GridLevels(unittest.TestCase):
+
+    def test_1d_normal(self):
+        smooth = gaussian_1d()
+        levels = list(smooth.get_levels(None, 68, 95))
+        for (low, high), z in zip(levels, [0.994, 1.96]):
+            self.assertAlmostEqual(low, 55 - 2 * z, delta=0.1)
+            self.assertAlmostEqual(high, 55 + 2 * z, delta=0.1)
+
+    def test_2d_mass(self):
+        smooth = gaussian_2d()
+        levels = list(smooth.get_levels(None, 68, 80, 95))
+        self.assertEqual(levels, sorted(levels, reverse=True))
+        for level, percentile in zip(levels, [68, 80, 95]):
+            mass = smooth.pdf[smooth.pdf >= level].sum()
+            self.assertAlmostEqual(mass, percentile / 100.0, 2)
+
+    def test_matches_data(self):
+        """Levels from the grid are close to those from a large sample."""
+        smooth = gaussian_1d()
+        data = np.random.RandomState(0).normal(55, 2, 20000)
+        for grid, sample in zip(smooth.get_levels(None, 68, 95),
+                                smooth.get_levels(data, 68, 95)):
+            np.testing.assert_allclose(grid, sample, atol=0.1)
+
+
+class Sampling(unittest.TestCase):
+
+    def test_cdf(self):
+        smooth = gaussian_2d()
+        cdf = smooth.cdf
+        self.assertIs(smooth.cdf, cdf)
+        self.assertAlmostEqual(cdf[-1, -1], smooth.pdf.sum() * 0.05)
+        self.assertAlmostEqual(cdf[75, 60], smooth.pdf[:76, :61].sum() * 0.05)
+
+        smooth.pdf = smooth.pdf * 2
+        self.assertAlmostEqual(smooth.cdf[-1, -1], 0.1)
+
+    def test_moments(self):
+        samples = gaussian_1d().random_sample(200000, rng=0)
+        self.assertEqual(samples.shape, (200000, ))
+        self.assertAlmostEqual(samples.mean(), 55, 1)
+        self.assertAlmostEqual(samples.var(), 4, 1)
+
+        samples = gaussian_2d().random_sample(200000, rng=0)
+        self.assertEqual(samples.shape, (200000, 2))
+        np.testing.assert_allclose(samples.mean(axis=0), [55, 20], atol=0.03)
+        np.testing.assert_allclose(samples.var(axis=0), [4, 8], rtol=0.02)
+
+    def test_rng(self):
+        smooth = gaussian_2d()
+        np.testing.assert_array_equal(smooth.random_sample(10, rng=3),
+                                      smooth.random_sample(10, rng=3))
+        generator = np.random.RandomState(3)
+        np.testing.assert_array_equal(smooth.random_sample(10, rng=3),
+                                      smooth.random_sample(10, generator))
+
+
+class BinnedKDE(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        rng = np.random.RandomState(0)
+        self.data_1d = np.concatenate([rng.normal(55, 2, 1500),
+                                       rng.normal(62, 1, 500)])[:, None]
+        self.data_2d = np.vstack([rng.normal([55, 20], [2, 1.5], (1500, 2)),
+                                  rng.normal([60, 30], [1, 1], (500, 2))])
+
+    def check_close(self, data, bandwidth, **kwargs):
+        exact = estimate_pdf(data, bandwidth=bandwidth, **kwargs)
+        binned = estimate_pdf(data, bandwidth=bandwidth, method='binned',
+                              **kwargs)
+        np.testing.assert_array_equal(binned.grid, exact.grid)
+        self.assertEqual(binned.bandwidth, exact.bandwidth)
+        error = np.abs(binned.pdf - exact.pdf).max() / exact.pdf.max()
+        self.assertLess(error, 0.01)
+
+    def test_1d(self):
+        self.check_close(self.data_1d, 0.5)
+        self.check_close(self.data_1d, 'silverman')
+
+    def test_2d(self):
+        self.check_close(self.data_2d, 0.5)
+
+    def test_given_grid(self):
+        """Data off the grid still adds the tails of its kernels."""
+        self.check_close(self.data_1d, 0.5, grid=np.linspace(54, 60, 31))
+
+    def test_bad_method(self):
+        self.assertRaises(ValueError, estimate_pdf, self.data_1d,
+                          bandwidth=0.5, method='exact')
+
+
+def exact_loo(data, bandwidths):
+    """Leave-one-out log likelihood from every pair of points."""
+    (n, dims) = data.shape
+    distances = ((data[:, None, :] - data[None, :, :])**2).sum(axis=-1)
+    likelihood = []
+    for bandwidth in bandwidths:
+        kernel = np.exp(-distances / (2 * bandwidth**2))
+        np.fill_diagonal(kernel, 0)
+        norm = (n - 1) * (np.sqrt(2 * np.pi) * bandwidth)**dims
+        likelihood.append(np.log(kernel.sum(axis=1) / norm).sum())
+    return bandwidths[np.argmax(likelihood)]
+
+
+class LikelihoodBandwidth(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        rng = np.random.RandomState(1)
+        self.data_1d = np.concatenate([rng.normal(55, 2, 600),
+                                       rng.normal(62, 0.5, 200)])[:, None]
+        self.data_2d = np.vstack([rng.normal([55, 20], [2, 1.5], (600, 2)),
+                                  rng.normal([60, 30], [0.5, 0.5], (200, 2))])
+        self.params = {'bandwidth': np.linspace(0.05, 1.0, 20)}
+
+    def test_matches_exact(self):
+        for data in [self.data_1d, self.data_2d]:
+            self.assertAlmostEqual(
+                estimate_bandwidth(data, 'loo', self.params),
+                exact_loo(data, self.params['bandwidth']))
+
+    def test_estimate_pdf(self):
+        smooth = estimate_pdf(self.data_1d, bandwidth='loo',
+                              params=self.params, method='binned')
+        self.assertIn(smooth.bandwidth, self.params['bandwidth'])
+
+    def test_needs_data(self):
+        self.assertRaises(ValueError, estimate_bandwidth, self.data_1d[:1],
+                          'loo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+Unit tests for index.py module.
+"""
+
+import unittest
+import numpy as np
+from shapely.geometry import Point
+from pluq.fileio import (read_pdf, read_ranges, read_region,
+                         read_region_raster)
+from pluq.index import IntervalIndex, RegionIndex, RegionRaster
+
+
+class RegionIndexCC(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.regions = read_region('cc', 95)
+        self.index = RegionIndex(self.regions)
+
+    def test_matches_brute_force(self):
+        """
+        The index should find the same regions as testing every region.
+        """
+        rng = np.random.RandomState(0)
+        points = rng.uniform(10, 180, size=(200, 2))
+        points = np.vstack([points, [[55.0, 18.0], [176.0, 55.0]]])
+
+        found = self.index.query_many(points)
+        for point, hits in zip(points, found):
+            expected = sorted(corr for corr, region in self.regions.items()
+                              if Point(point).within(region))
+            self.assertEqual(hits, expected)
+
+    def test_known_hit(self):
+        self.assertIn('Ala-(CA,CB)-All', self.index.query((53.0, 19.0)))
+        self.assertEqual(self.index.query((-100.0, -100.0)), [])
+
+
+class RegionRasterCC(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.regions = read_region('cc', 95)
+        self.index = RegionIndex(self.regions)
+        rng = np.random.RandomState(0)
+        self.points = np.vstack([rng.uniform(10, 180, size=(2000, 2)),
+                                 rng.uniform(10, 70, size=(2000, 2))])
+
+    def test_matches_index(self):
+        """
+        A coarse raster should give the same answer as the exact index,
+        the boundary cells fall back to it.
+        """
+        raster = RegionRaster.from_regions(self.regions, step=0.5,
+                                           fallback=self.index)
+        self.assertEqual(raster.query_many(self.points),
+                         self.index.query_many(self.points))
+
+    def test_shipped_raster(self):
+        raster = read_region_raster('cc', 95, self.index)
+        self.assertAlmostEqual(raster.step, 0.05)
+        self.assertEqual(raster.query_many(self.points),
+                         self.index.query_many(self.points))
+        self.assertIn('Ala-(CA,CB)-All', raster.query((53.0, 19.0)))
+        self.assertEqual(raster.query((-100.0, -100.0)), [])
+
+    def test_contains(self):
+        raster = read_region_raster('cc', 95, self.index)
+        names = raster.names[::25] + ['Not-(A)-Region']
+        for point in self.points[::20]:
+            hits = self.index.query(point)
+            for name in names:
+                self.assertEqual(raster.contains(name, point), name in hits)
+                self.assertEqual(self.index.contains(name, point),
+                                 name in hits)
+
+    def test_bad_level(self):
+        self.assertRaises(ValueError, read_region_raster, 'cc', 50)
+
+
+class IntervalIndexC(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        pdf_file = read_pdf('c')
+        self.ranges = read_ranges(pdf_file, 95)
+        pdf_file.close()
+        self.index = IntervalIndex(self.ranges)
+
+    def test_matches_brute_force(self):
+        """
+        The index should find the same ranges as testing every range.
+        """
+        shifts = np.linspace(0, 200, 801)
+        found = self.index.query_many(shifts)
+        for shift, hits in zip(shifts, found):
+            expected = sorted(corr for corr, (low, high) in self.ranges.items()
+                              if low <= shift <= high)
+            self.assertEqual(sorted(hits), expected)
+
+    def test_contains(self):
+        for shift in np.linspace(0, 200, 101):
+            hits = self.index.query(shift)
+            for name in self.index.names[::10]:
+                self.assertEqual(self.index.contains(name, shift),
+                                 name in hits)
+
+    def test_query(self):
+        self.assertIn('Ala-(CB)-All', self.index.query(18.0))
+        self.assertEqual(self.index.query(-50.0), [])
+
+    def test_bad_level(self):
+        pdf_file = read_pdf('c')
+        self.assertRaises(ValueError, read_ranges, pdf_file, 50)
+        pdf_file.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
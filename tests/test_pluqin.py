@@ -0,0 +1,214 @@
+"""
+Unit tests for pluqin.py module.
+"""
+
+import unittest
+import numpy as np
+import pluq.base as base
+from pluq.cache import query_cache
+from pluq.inbase import standard_experiments
+from pluq.pluqin import (main, score_matrix, stack_score_matrix,
+                         get_resonance_choices,
+                         get_resonance_set_choices, assignment_table,
+                         iter_assignments, table_rows, assign_groups,
+                         iter_main, get_resonance_set_levels,
+                         assign_spectrum)
+
+
+class ScoreMatrixC(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.peaks = [55.0, 18.0, 176.0, 250.0]
+        protein = base.ProteinSeq('AGLM')
+        self.correlations = protein.relevant_correlations(
+            standard_experiments['c'], structure=False,
+            ignoresymmetry=True, offdiagonal=False)
+
+    def test_matches_single_scores(self):
+        scores = score_matrix(self.peaks, self.correlations, 'c')
+        self.assertEqual(scores.shape,
+                         (len(self.peaks), len(self.correlations)))
+
+        for n, corr in enumerate(self.correlations):
+            try:
+                smooth = query_cache.get_pdf(corr, 'c')
+            except KeyError:
+                self.assertTrue(np.isnan(scores[:, n]).all())
+                continue
+            for k, peak in enumerate(self.peaks):
+                self.assertEqual(scores[k, n], smooth.score(peak))
+
+    def test_stack_matches_score_matrix(self):
+        stacked = stack_score_matrix(self.peaks, self.correlations, 'c')
+        self.assertEqual(stacked.shape, (4, len(self.peaks),
+                                         len(self.correlations)))
+        for layer, ss in enumerate(['X', 'H', 'C', 'E']):
+            corrs = [base.Correlation(x.aa, x.atoms, ss)
+                     for x in self.correlations]
+            np.testing.assert_allclose(
+                stacked[layer], score_matrix(self.peaks, corrs, 'c'),
+                rtol=1e-12, atol=1e-15)
+
+    def test_set_choices_match_single_choices(self):
+        choice_sets = get_resonance_set_choices(
+            self.peaks, self.correlations, 'c')
+        for peak, choices in zip(self.peaks, choice_sets):
+            self.assertEqual(
+                dict(choices),
+                dict(get_resonance_choices(peak, self.correlations, 'c')))
+
+
+class ResonanceLevelsC(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.peaks = [55.0, 18.0, 64.0, 176.0, 250.0]
+        protein = base.ProteinSeq(None)
+        self.correlations = protein.relevant_correlations(
+            standard_experiments['c'], structure=False,
+            ignoresymmetry=True, offdiagonal=False)
+
+    def test_matches_single_levels(self):
+        """
+        The tightest level tag should match separate queries at each
+        level, and the scores the single level query.
+        """
+        tagged = get_resonance_set_levels(self.peaks, self.correlations, 'c')
+        by_level = {x: get_resonance_set_choices(
+            self.peaks, self.correlations, 'c', x) for x in [68, 80, 95]}
+
+        for k, choices in enumerate(tagged):
+            for res, assignments in choices.items():
+                expected = by_level[95][k][res]
+                self.assertEqual([x[:4] for x in assignments],
+                                 [x[:4] for x in expected])
+                for assign in assignments:
+                    tightest = min(
+                        x for x in by_level if assign.atoms in
+                        [y.atoms for y in by_level[x][k].get(res, [])])
+                    self.assertEqual(assign.level, tightest)
+
+    def test_some_inner_levels(self):
+        tagged = get_resonance_set_levels([55.0], self.correlations, 'c')
+        levels = set(x.level for y in tagged[0].values() for x in y)
+        self.assertTrue(levels > {95})
+
+    def test_bad_level(self):
+        self.assertRaises(ValueError, get_resonance_set_levels, [55.0],
+                          self.correlations, 'c', [50, 95])
+
+
+class MainC(unittest.TestCase):
+
+    def test_alanine_ca_cb(self):
+        table = main([55.0, 18.0], 'c')
+        self.assertEqual(table[0][:3], ('A', ('CA', ), ('CB', )))
+
+    def test_linear_mode(self):
+        spline = main([55.0, 18.0], 'c')
+        linear = main([55.0, 18.0], 'c', mode='linear')
+        self.assertEqual(len(spline), len(linear))
+        self.assertEqual(spline[0], linear[0])
+
+    def test_top_n(self):
+        peaks = [55.0, 30.0, 25.0, 176.0]
+        table = main(peaks, 'c')
+        top = main(peaks, 'c', top_n=5)
+        self.assertEqual(len(top), 5)
+        self.assertEqual([x[9] for x in top], [x[9] for x in table[:5]])
+
+    def test_min_joint(self):
+        peaks = [55.0, 18.0]
+        table = main(peaks, 'c')
+        cut = main(peaks, 'c', min_joint=1.0)
+        self.assertEqual(cut, [x for x in table if x[5] > 1.0])
+
+    def test_sorted(self):
+        table = main([55.0, 30.0, 25.0], 'c')
+        keys = [(x[7], sum(x[4:7])) for x in table]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+
+    def test_assign_groups(self):
+        groups = [[55.0, 18.0], [176.0], [42.0], [55.0, 18.0]]
+        tables = list(assign_groups(groups, 'c', processes=2, top_n=5))
+        self.assertEqual(tables, [main(x, 'c', top_n=5) for x in groups])
+
+    def test_sigma(self):
+        peaks = [55.0, 18.0]
+        table = main(peaks, 'c')
+        self.assertEqual(main(peaks, 'c', sigma=0), table)
+        blurred = main(peaks, 'c', sigma=0.5)
+        self.assertEqual(blurred[0][:3], table[0][:3])
+        self.assertNotEqual(blurred[0][3:], table[0][3:])
+        self.assertRaises(ValueError, main, peaks, 'c', sigma=-0.5)
+
+    def test_iter_main(self):
+        peaks = [55.0, 30.0, 25.0]
+        self.assertEqual(list(iter_main(peaks, 'c')), main(peaks, 'c'))
+        self.assertEqual(list(iter_main(peaks, 'c', top_n=3, min_joint=1.0)),
+                         main(peaks, 'c', top_n=3, min_joint=1.0))
+        self.assertEqual(list(iter_main([500.0], 'c')), [])
+        # Bad input is found before the first row is asked for.
+        self.assertRaises(ValueError, iter_main, [[55.0, 18.0]], 'c')
+
+    def test_peak_dims(self):
+        self.assertRaises(ValueError, main, [[55.0, 18.0]], 'c')
+
+    def test_bad_level(self):
+        self.assertRaises(ValueError, main, [55.0], 'c', level=50)
+
+
+class AssignmentTableC(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.peaks = [55.0, 18.0]
+        protein = base.ProteinSeq(None)
+        correlations = protein.relevant_correlations(
+            standard_experiments['c'], structure=False,
+            ignoresymmetry=True, offdiagonal=False)
+        self.assignment_sets = get_resonance_set_choices(
+            self.peaks, correlations, 'c')
+        self.weights = protein.aa_fractions
+
+    def test_columns(self):
+        table = assignment_table(self.assignment_sets, self.weights)
+        self.assertEqual(table['scores'].shape, (len(table), 2))
+        self.assertEqual(table['ss'].shape, (len(table), 3))
+        self.assertAlmostEqual(table['joint'].sum(), 100, delta=1)
+        self.assertEqual(table_rows(table), main(self.peaks, 'c'))
+
+    def test_generator(self):
+        table = table_rows(assignment_table(self.assignment_sets,
+                                            self.weights, top_n=4))
+        rows = list(iter_assignments(self.assignment_sets, self.weights,
+                                     top_n=4))
+        self.assertEqual(table, rows)
+
+
+class AssignSpectrumC(unittest.TestCase):
+
+    def test_matches_main(self):
+        """
+        For one peak the posterior is main's joint probability.
+        """
+        correlations, posteriors = assign_spectrum([[55.0], [18.0]], 'c')
+        for k, peak in enumerate([55.0, 18.0]):
+            for row in main([peak], 'c'):
+                n = correlations.index(base.Correlation(row[0], row[1],
+                                                        None))
+                self.assertAlmostEqual(100 * posteriors[k, n], row[2],
+                                       delta=0.051)
+
+    def test_rows_normalized(self):
+        peaks = np.linspace(10, 200, 500)
+        correlations, posteriors = assign_spectrum(peaks, 'c', seq='MKALVE')
+        self.assertEqual(posteriors.shape, (500, len(correlations)))
+        totals = posteriors.sum(axis=1)
+        self.assertTrue(np.all((np.abs(totals - 1) < 1e-9) | (totals == 0)))
+        self.assertEqual(totals[-1], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Unit tests for server.py module.
+"""
+
+import json
+import threading
+import unittest
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError
+
+from pluq.cache import query_cache
+from pluq.pluqin import main
+from pluq.server import make_server, query, warm, _jsonable
+
+
+class QueryServerC(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = make_server(port=0, experiments=['c'])
+        cls.url = 'http://{}:{}'.format(*cls.server.server_address[:2])
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def post(self, request):
+        if isinstance(request, bytes):
+            data = request
+        else:
+            data = json.dumps(request).encode('utf-8')
+        req = Request(self.url + '/assign', data,
+                      {'Content-Type': 'application/json'})
+        return json.loads(urlopen(req).read().decode('utf-8'))
+
+    def test_assign(self):
+        answer = self.post({'peaks': [55.0, 18.0], 'experiment': 'c'})
+        self.assertEqual(answer['table'], _jsonable(main([55.0, 18.0], 'c')))
+
+    def test_concurrent(self):
+        answers = []
+
+        def run():
+            answers.append(self.post({'peaks': [55.0, 18.0], 'top_n': 3}))
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(answers), 8)
+        self.assertTrue(all(x == answers[0] for x in answers))
+
+    def test_bad_request(self):
+        with self.assertRaises(HTTPError) as context:
+            self.post({'shifts': [55.0]})
+        self.assertEqual(context.exception.code, 400)
+
+    def assert_error(self, request, code=400):
+        errors = self.server.counts['errors']
+        with self.assertRaises(HTTPError) as context:
+            self.post(request)
+        self.assertEqual(context.exception.code, code)
+        body = json.loads(context.exception.read().decode('utf-8'))
+        self.assertIn('error', body)
+        self.assertEqual(self.server.counts['errors'], errors + 1)
+
+    def test_malformed_body(self):
+        self.assert_error(b'{"peaks": [55.0')
+        self.assert_error({'peaks': 5})
+        self.assert_error({'peaks': [55.0], 'top_n': 'x'})
+
+    def test_missing_data_file(self):
+        self.assert_error({'peaks': [[55.0, 18.0]], 'experiment': 'cc'})
+
+    def test_health(self):
+        health = json.loads(urlopen(self.url + '/health').read().decode(
+            'utf-8'))
+        self.assertEqual(health['status'], 'ok')
+        self.assertIn('pdfs', health['cache'])
+
+
+class Warm(unittest.TestCase):
+
+    def test_main_reads_nothing(self):
+        """After warming, main is answered from the cache alone."""
+        warm(['c'])
+        before = query_cache.info()
+        main([55.0, 18.0, 176.0], 'c')
+        after = query_cache.info()
+        self.assertEqual(after['stacks'].misses, before['stacks'].misses)
+        self.assertEqual(after['pdfs'].misses, before['pdfs'].misses)
+        self.assertGreater(after['stacks'].hits, before['stacks'].hits)
+
+
+class Query(unittest.TestCase):
+
+    def test_unknown_option(self):
+        self.assertRaises(ValueError, query, {'peaks': [55.0], 'x': 1})
+
+    def test_bad_sigma(self):
+        for sigma in [-0.5, 100.0, 'x', True]:
+            self.assertRaises(ValueError, query,
+                              {'peaks': [55.0], 'sigma': sigma})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Cold-start tests for the PLUQin query path, each runs a fresh
+interpreter so nothing is already imported.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+# Modules only needed to build PDFs and regions.
+heavy_modules = ['sklearn', 'skimage', 'fiona', 'scipy', 'pkg_resources']
+
+# Seconds allowed for one 1D query from the command line, including
+# starting Python. It is about 0.5 s on a laptop, the budget leaves
+# room for slow test machines.
+cold_start_budget = 3.0
+
+
+def run_python(args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [x for x in [env.get('PYTHONPATH')] if x])
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-W', 'ignore'] + args,
+                                     env=env, cwd=root)
+    return output.decode('utf-8'), time.time() - start
+
+
+class QueryPathImports(unittest.TestCase):
+
+    def test_no_heavy_imports(self):
+        """
+        Answering a query should not import the PDF building
+        dependencies.
+        """
+        code = ('import sys, json; from pluq.pluqin import main; '
+                'main([55.0, 18.0], "c"); '
+                'print(json.dumps(sorted(x for x in {} if x in sys.modules)))'
+                ).format(heavy_modules)
+        output, _ = run_python(['-c', code])
+        self.assertEqual(json.loads(output), [])
+
+
+class CommandLineColdStart(unittest.TestCase):
+
+    def test_budget(self):
+        script = os.path.join('scripts', 'pluqin.py')
+        output, seconds = run_python([script, '-p', '55', '-p', '18'])
+        self.assertIn('experiment: c', output)
+        self.assertLess(seconds, cold_start_budget,
+                        msg='cold start took {:.2f} s'.format(seconds))
+
+
+if __name__ == '__main__':
+    unittest.main()